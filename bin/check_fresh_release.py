@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""Check whether there was a release of the current project recently.
+
+Run using check_fresh_release branch duration [folder]
+      - branch is the name of the branch where the released version is at (default origin/prod).
+      - duration is a `date` readable duration, for which it is admitted to have non-released
+        code, e.g. '14 days' (default).
+      - folder is a subfolder of the repository to which we restrict the search of changes since
+        release.
+Several projects can be checked at once with --project folder:branch (repeated), in which case
+the history since each release branch is only walked once, whatever the number of folders.
+
+Exits with an error code if some code has been waiting for a release for too long.
+"""
+
+import argparse
+import datetime
+import json
+from os import path
+import re
+import subprocess
+import sys
+from typing import Any, Iterator, NamedTuple, Optional, Sequence
+
+# Units of durations, as understood by `date`.
+_DURATION_UNITS = {
+    'sec': datetime.timedelta(seconds=1),
+    'second': datetime.timedelta(seconds=1),
+    'min': datetime.timedelta(minutes=1),
+    'minute': datetime.timedelta(minutes=1),
+    'hour': datetime.timedelta(hours=1),
+    'day': datetime.timedelta(days=1),
+    'week': datetime.timedelta(weeks=1),
+    'fortnight': datetime.timedelta(weeks=2),
+}
+_DURATION_MONTHS = {'month': 1, 'year': 12}
+_DURATION_PART = re.compile(r'\s*([+-]?\d+)?\s*([a-z]+?)s?\b\s*', re.IGNORECASE)
+# The format of commit dates, as given by git's %ci.
+_GIT_DATE_FORMAT = '%Y-%m-%d %H:%M:%S %z'
+
+
+def _add_duration(start: datetime.datetime, duration: str) -> datetime.datetime:
+    """Add a duration such as '14 days' or '1 month 2 weeks' to a date, as `date` would."""
+
+    end = start
+    position = 0
+    while position < len(duration):
+        part = _DURATION_PART.match(duration, position)
+        if not part or not part.group(0):
+            raise ValueError(f'Invalid duration: "{duration}".')
+        position = part.end()
+        count = int(part.group(1) or 1)
+        unit = part.group(2).lower()
+        if unit in _DURATION_UNITS:
+            end += count * _DURATION_UNITS[unit]
+        elif unit in _DURATION_MONTHS:
+            # Days overflow to the next month, e.g. Jan 31 + 1 month is Mar 3 (or 2).
+            months = end.year * 12 + end.month - 1 + count * _DURATION_MONTHS[unit]
+            end = end.replace(year=months // 12, month=months % 12 + 1, day=1) + \
+                datetime.timedelta(days=end.day - 1)
+        else:
+            raise ValueError(f'Invalid duration: "{duration}", unknown unit "{unit}".')
+    return end
+
+
+class _Commit(NamedTuple):
+    sha1: str
+    date: datetime.datetime
+    author: str
+    subject: str
+    # Files changed by the commit, relative to the root of the repository.
+    files: list[str]
+
+
+class _Project(NamedTuple):
+    # Folder relative to the root of the repository, empty for the whole repository.
+    folder: str
+    branch: str
+
+
+def _run_git(git_command: list[str]) -> str:
+    return subprocess.check_output(['git'] + git_command, text=True).strip()
+
+
+def _iterate_unreleased_commits(
+        branch: str, default_branch: str, folders: Sequence[str]) -> Iterator[_Commit]:
+    """Iterate over the commits of the default branch which are not in the branch, newest first.
+
+    Only the commits changing the given folders are listed, or all of them if no folders are given.
+    """
+
+    # Renames are not detected, so that a file moved out of a folder is still listed in it.
+    log = _run_git([
+        '-c', 'core.quotePath=false', 'log', '--name-only', '--no-renames',
+        '--format=%x00%H%n%ci%n%an%n%s', f'{branch}..{default_branch}', '--'] + list(folders))
+    for commit in log.split('\0')[1:]:
+        sha1, date, author, subject, *files = commit.strip('\n').split('\n')
+        yield _Commit(
+            sha1, datetime.datetime.strptime(date, _GIT_DATE_FORMAT), author, subject,
+            [file for file in files if file])
+
+
+def _is_in_folder(file: str, folder: str) -> bool:
+    return not folder or file == folder or file.startswith(f'{folder}/')
+
+
+def _get_unreleased_commits(
+        projects: Sequence[_Project], default_branch: str) -> dict[_Project, list[_Commit]]:
+    """Get the unreleased commits changing each project, oldest first."""
+
+    commits: dict[_Project, list[_Commit]] = {project: [] for project in projects}
+    for branch in {project.branch for project in projects}:
+        branch_projects = [project for project in projects if project.branch == branch]
+        folders = [project.folder for project in branch_projects]
+        if not all(folders):
+            folders = []
+        for commit in _iterate_unreleased_commits(branch, default_branch, folders):
+            for project in branch_projects:
+                # Merge commits are only considered for the whole repository, as in `git log`.
+                if not project.folder or any(
+                        _is_in_folder(file, project.folder) for file in commit.files):
+                    commits[project].append(commit)
+    for project_commits in commits.values():
+        project_commits.reverse()
+    return commits
+
+
+def _get_repo_folder(prefix: str, folder: str) -> str:
+    repo_folder = path.normpath(path.join(prefix, folder))
+    return '' if repo_folder == '.' else repo_folder
+
+
+def _parse_project(project: str) -> _Project:
+    folder, separator, branch = project.rpartition(':')
+    if not separator or not branch:
+        raise argparse.ArgumentTypeError(f'"{project}" is not of the form folder:branch.')
+    return _Project(folder, branch)
+
+
+def _make_report(
+        project: _Project, commits: Sequence[_Commit], duration: str) -> dict[str, Any]:
+    # All keys are always given, with None when there are no unreleased commits.
+    report: dict[str, Any] = {
+        'folder': project.folder,
+        'branch': project.branch,
+        'isFresh': True,
+        'oldestUnreleasedCommit': None,
+        'unreleasedSince': None,
+        'unreleasedCommitsCount': len(commits),
+    }
+    if commits:
+        oldest_date = commits[0].date
+        rotting_end = _add_duration(oldest_date.astimezone(), duration).date()
+        report.update({
+            'isFresh': rotting_end > datetime.date.today(),
+            'oldestUnreleasedCommit': commits[0].sha1,
+            'unreleasedSince': oldest_date.isoformat(),
+        })
+    return report
+
+
+def _print_report(
+        report: dict[str, Any], commits: Sequence[_Commit], default_branch: str,
+        duration: str) -> None:
+    branch = report['branch']
+    if not commits:
+        print(f'No commits on {default_branch} since {branch}.')
+        return
+    since = commits[0].date.strftime(_GIT_DATE_FORMAT)
+    if report['isFresh']:
+        print(f'The oldest commit on {default_branch} after {branch} is less than {duration} old:')
+        print(since)
+        return
+    print(f'There is some unreleased code on {default_branch} since {since}')
+    for commit in commits:
+        print(f'{commit.sha1[:10]} {commit.date.strftime(_GIT_DATE_FORMAT)} {commit.author}: '
+              f'{commit.subject}')
+
+
+def main(string_args: Optional[Sequence[str]] = None) -> None:
+    """Check the release freshness of the given projects."""
+
+    parser = argparse.ArgumentParser(
+        description='Check whether there was a release of the current project recently.')
+    parser.add_argument(
+        'branch', default='origin/prod', nargs='?',
+        help='The branch where the released version is at.')
+    parser.add_argument(
+        'duration', default='14 days', nargs='?',
+        help='The duration for which it is admitted to have non-released code, e.g. "14 days".')
+    parser.add_argument(
+        'folder', default='', nargs='?',
+        help='A subfolder of the repository to which we restrict the search of changes.')
+    parser.add_argument(
+        '--project', dest='projects', action='append', type=_parse_project,
+        metavar='FOLDER:BRANCH',
+        help='A folder and the branch where its released version is at. Can be repeated, and '
+        'then replaces the positional branch and folder.')
+    parser.add_argument(
+        '--json', action='store_true', help='Print a JSON report of all projects instead.')
+    args = parser.parse_args(string_args)
+
+    try:
+        _add_duration(datetime.datetime.now(), args.duration)
+    except ValueError as error:
+        sys.exit(str(error))
+    # Folders are given relative to the current directory, while git lists files from the root.
+    prefix = _run_git(['rev-parse', '--show-prefix'])
+    projects = [
+        _Project(_get_repo_folder(prefix, folder), branch)
+        for folder, branch in args.projects or [(args.folder, args.branch)]]
+    default_branch = _run_git(['rev-parse', '--abbrev-ref', 'origin/HEAD'])
+
+    all_commits = _get_unreleased_commits(projects, default_branch)
+    reports = [
+        _make_report(project, all_commits[project], args.duration)
+        for project in projects]
+    if args.json:
+        print(json.dumps({'defaultBranch': default_branch, 'projects': reports}, indent=2))
+    else:
+        for project, report in zip(projects, reports):
+            if len(projects) > 1:
+                print(f'{project.folder or "."}:', end=' ')
+            _print_report(report, all_commits[project], default_branch, args.duration)
+    if not all(report['isFresh'] for report in reports):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    import ci_daemon
+    ci_daemon.forward_to_daemon(__file__)
+    main()
@@ -7,36 +7,66 @@ Run using check_recent_todos duration [folder]
 """
 
 import argparse
+import collections
+import datetime
 import functools
+import json
 import logging
 import os
 from os import path
 import re
 import subprocess
 import sys
+import time
 import typing
-from typing import Any, Dict, Iterator, List, Optional
-
-import requests
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 
 def _run_git(git_command: List[str]) -> str:
     return subprocess.check_output(['git'] + git_command, text=True).strip()
 
 
-def _grep_all_todos(folder: str) -> List[str]:
-    return subprocess.check_output(['grep', r'\bTODO\b', '-nrI', folder], text=True).split('\n')
+def _git_grep_all_todos(revision: str, folder: str) -> List[str]:
+    """Grep TODOs in a folder at a given revision, straight from git objects."""
+
+    try:
+        output = _run_git([
+            '-c', 'core.quotePath=false', 'grep', '-nIw', '-e', 'TODO', revision, '--', folder])
+    except subprocess.CalledProcessError as error:
+        if error.returncode == 1:
+            # No TODO found.
+            return []
+        raise
+    # Lines are prefixed by the revision: "revision:file:line:text".
+    return [line.removeprefix(f'{revision}:') for line in output.split('\n')]
 
 
 _TODO_FILE_REGEX = re.compile(r'^([^:]*):')
+# Starting with a literal is much faster for the regex engine, the word boundary before TODO is
+# checked separately.
+_TODO_BYTES_REGEX = re.compile(rb'TODO\b')
+_WORD_BYTES_REGEX = re.compile(rb'\w')
+_NEW_LINE_BYTES_REGEX = re.compile(b'\n')
+# Files with a NUL byte in their first bytes are considered binary, and skipped.
+_BINARY_CHECK_SIZE = 8192
+# Files smaller than this are read at once, bigger ones are mapped in memory.
+_MMAP_MIN_SIZE = 1 << 18
+# Number of files scanned in a row by each process.
+_SCAN_CHUNK_SIZE = 64
+# Increase this when changing how TODOs are parsed, to invalidate the TODO index caches.
+_TODO_INDEX_VERSION = 1
+_SQLITE_MAX_VARIABLES = 999
+# Name of the owner column for TODOs without any owner in series.
+_NO_OWNER = '(none)'
+# Number of owners detailed in the Slack summary of a series.
+_SLACK_SERIES_MAX_OWNERS = 10
+_DIFF_HUNK_REGEX = re.compile(r'^@@ -(\d+)(?:,\d+)? \+(\d+)(?:,\d+)? @@')
 _TODO_LINE_REGEX = re.compile(r'\bTODO\b(?:\(([^)]+)\))?:?\s*(.*)')
 
-_SLACK_INTEGRATION_URL = os.getenv('SLACK_INTEGRATION_URL')
-_PROJECT_USERNAME = os.getenv('CIRCLE_PROJECT_USERNAME', 'bayesimpact')
-_PROJECT_REPONAME = os.getenv('CIRCLE_PROJECT_REPONAME', 'bob-emploi-internal')
-_GIT_SHA1 = os.getenv('CIRCLE_SHA1') or _run_git(['rev-parse', 'HEAD'])
-_IS_TTY = sys.stdout.isatty()
-_URL_TO_FILE = f'https://github.com/{_PROJECT_USERNAME}/{_PROJECT_REPONAME}/blob/{_GIT_SHA1}/'
+
+def _get_github_repo() -> str:
+    return f'{os.getenv("CIRCLE_PROJECT_USERNAME", "bayesimpact")}/' \
+        f'{os.getenv("CIRCLE_PROJECT_REPONAME", "bob-emploi-internal")}'
 
 
 @functools.lru_cache
@@ -44,6 +74,12 @@ def _get_repo_root() -> str:
     return _run_git(['rev-parse', '--show-toplevel'])
 
 
+@functools.lru_cache
+def _get_url_to_file() -> str:
+    git_sha1 = os.getenv('CIRCLE_SHA1') or _run_git(['rev-parse', 'HEAD'])
+    return f'https://github.com/{_get_github_repo()}/blob/{git_sha1}/'
+
+
 class _TodoRef(typing.NamedTuple):
     file: str
     line: int
@@ -61,18 +97,27 @@ class _TodoRef(typing.NamedTuple):
         except ValueError:
             logging.error('Unable to split line:\n%r', todo_line)
             return None
+        return _TodoRef.from_text(file, int(line_str), full_text)
+
+    @staticmethod
+    def from_text(file: str, line: int, full_text: str) -> '_TodoRef':
+        """Create a _TodoRef from the full text of a line with a TODO."""
+
         owner: Optional[str] = None
         text = full_text
         match = _TODO_LINE_REGEX.search(full_text)
         if match:
             owner, text = match.groups()
-        return _TodoRef(file, int(line_str), text, owner)
+        return _TodoRef(file, line, text, owner)
 
     def __eq__(self, other: Any) -> bool:
         if not isinstance(other, _TodoRef):
             return False
         return self.file == other.file and self.text == other.text
 
+    def __hash__(self) -> int:
+        return hash((self.file, self.text))
+
     def __str__(self) -> str:
         owner_text = f'{self.owner}: ' if self.owner else ''
         return f'{self.file}#L{self.line}: {owner_text}{self.text}'
@@ -80,7 +125,7 @@ class _TodoRef(typing.NamedTuple):
     def format_for_tty(self) -> str:
         """Format the _TodoRef with colors if it's in a terminal."""
 
-        if not _IS_TTY:
+        if not sys.stdout.isatty():
             return str(self)
 
         owner_text = f'{self.owner}: ' if self.owner else ''
@@ -93,13 +138,186 @@ class _TodoRef(typing.NamedTuple):
         """Format the _TodoRef for slack output."""
 
         owner_text = f'{self.owner}: ' if self.owner else ''
-        return f'<{_URL_TO_FILE}{path.relpath(self.file, start=_get_repo_root())}#L{self.line}' + \
+        file_path = path.relpath(self.file, start=_get_repo_root())
+        return f'<{_get_url_to_file()}{file_path}#L{self.line}' + \
             f'|{self.file}:{self.line}>: {owner_text}{self.text}'
 
 
-def _grep_and_parse_all_todos(folder: str) -> Iterator[_TodoRef]:
+def _list_files(folder: str) -> List[str]:
+    """List the files of a folder tracked by git, as git grep does in old revisions."""
+
+    return [
+        file_path
+        for file_path in subprocess.check_output([
+            'git', '-c', 'core.quotePath=false', 'ls-files', '-z', '--cached', '--', folder,
+        ], text=True).split('\0')
+        # Skip deleted files, links and submodules.
+        if file_path and path.isfile(file_path) and not path.islink(file_path)]
+
+
+def _scan_content(file_path: str, content: Any) -> Iterator[_TodoRef]:
+    """Find TODOs in the bytes content of a file."""
+
+    if b'\0' in content[:_BINARY_CHECK_SIZE]:
+        # Binary file.
+        return
+    line = 1
+    last_position = 0
+    next_line_start = 0
+    for match in _TODO_BYTES_REGEX.finditer(content):
+        start = match.start()
+        if start < next_line_start:
+            # Another TODO in the same line.
+            continue
+        if start and _WORD_BYTES_REGEX.match(content, start - 1):
+            continue
+        line += len(_NEW_LINE_BYTES_REGEX.findall(content, last_position, start))
+        last_position = start
+        line_start = content.rfind(b'\n', 0, start) + 1
+        line_end = content.find(b'\n', start)
+        if line_end < 0:
+            line_end = len(content)
+        next_line_start = line_end + 1
+        full_text = content[line_start:line_end].decode('utf-8', 'replace').rstrip('\r')
+        yield _TodoRef.from_text(file_path, line, full_text)
+
+
+def _scan_files(file_paths: List[str]) -> List[_TodoRef]:
+    import mmap  # pylint: disable=import-outside-toplevel
+
+    todos: List[_TodoRef] = []
+    for file_path in file_paths:
+        try:
+            with open(file_path, 'rb') as file:
+                size = os.fstat(file.fileno()).st_size
+                if not size:
+                    continue
+                if size < _MMAP_MIN_SIZE:
+                    todos.extend(_scan_content(file_path, file.read()))
+                    continue
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as content:
+                    todos.extend(_scan_content(file_path, content))
+        except OSError as error:
+            logging.warning('Unable to scan file "%s": %s', file_path, error)
+    return todos
+
+
+def _scan_all_todos(folder: str, jobs: Optional[int] = None) -> Iterator[_TodoRef]:
+    """Find all TODOs in the files of a folder, scanning them in parallel processes."""
+
+    file_paths = _list_files(folder)
+    chunks = [
+        file_paths[start:start + _SCAN_CHUNK_SIZE]
+        for start in range(0, len(file_paths), _SCAN_CHUNK_SIZE)]
+    if len(chunks) < 2 or jobs == 1:
+        for chunk in chunks:
+            yield from _scan_files(chunk)
+        return
+    from concurrent import futures  # pylint: disable=import-outside-toplevel
+    import multiprocessing  # pylint: disable=import-outside-toplevel
+
+    # Forking is not safe here, as this script may run in a thread of the CI daemon.
+    with futures.ProcessPoolExecutor(
+            jobs, mp_context=multiprocessing.get_context('forkserver')) as executor:
+        for todos in executor.map(_scan_files, chunks):
+            yield from todos
+
+
+class _TodoIndex:
+    """An index of the TODOs in git blobs, keyed by their SHA, and stored in SQLite.
+
+    As blobs are immutable, each of them only needs to be parsed once.
+    """
+
+    def __init__(self, db_path: str = ':memory:') -> None:
+        import sqlite3  # pylint: disable=import-outside-toplevel
+
+        self._db = sqlite3.connect(db_path)
+        if self._db.execute('PRAGMA user_version').fetchone()[0] != _TODO_INDEX_VERSION:
+            # The index was made with another version of the parser.
+            self._db.execute('DROP TABLE IF EXISTS blob_todos')
+            self._db.execute(f'PRAGMA user_version = {_TODO_INDEX_VERSION:d}')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS blob_todos (blob TEXT PRIMARY KEY, todos TEXT NOT NULL)')
+        self.cached_blobs_count = 0
+        self.parsed_blobs_count = 0
+
+    def close(self) -> None:
+        """Save the index and close it."""
+
+        self._db.commit()
+        self._db.close()
+
+    def get_revision_todos(self, revision: str, folder: str) -> Iterator[_TodoRef]:
+        """Find all TODOs in a folder at a given revision."""
+
+        blob_files: Dict[str, List[str]] = collections.defaultdict(list)
+        for entry in _run_git([
+                '-c', 'core.quotePath=false', 'ls-tree', '-rz', revision, '--', folder,
+        ]).split('\0'):
+            if not entry:
+                continue
+            mode, object_type, blob = entry.split('\t', 1)[0].split(' ')
+            # Skip submodules and links.
+            if object_type == 'blob' and mode != '120000':
+                blob_files[blob].append(entry.split('\t', 1)[1])
+        for blob, todos in self._get_blobs_todos(list(blob_files)):
+            for file_path in blob_files[blob]:
+                for line, text, owner in todos:
+                    yield _TodoRef(file_path, line, text, owner)
+
+    def _get_blobs_todos(self, blobs: List[str]) \
+            -> Iterator[Tuple[str, List[Tuple[int, str, Optional[str]]]]]:
+        missing_blobs = set(blobs)
+        for start in range(0, len(blobs), _SQLITE_MAX_VARIABLES):
+            batch = blobs[start:start + _SQLITE_MAX_VARIABLES]
+            for blob, todos_json in self._db.execute(
+                    'SELECT blob, todos FROM blob_todos '
+                    f'WHERE blob IN ({", ".join("?" * len(batch))})', batch):
+                missing_blobs.discard(blob)
+                self.cached_blobs_count += 1
+                yield blob, [tuple(todo) for todo in json.loads(todos_json)]
+        for blob, content in _cat_blobs(missing_blobs):
+            todos = [(todo.line, todo.text, todo.owner) for todo in _scan_content('', content)]
+            self._db.execute(
+                'INSERT OR REPLACE INTO blob_todos VALUES (?, ?)', (blob, json.dumps(todos)))
+            self.parsed_blobs_count += 1
+            yield blob, todos
+
+
+def _cat_blobs(blobs: typing.Iterable[str]) -> Iterator[Tuple[str, bytes]]:
+    """Read the content of git blobs."""
+
+    import threading  # pylint: disable=import-outside-toplevel
+
+    with subprocess.Popen(
+            ['git', 'cat-file', '--batch'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE) as cat_file:
+        assert cat_file.stdin and cat_file.stdout
+        stdin = cat_file.stdin
+
+        def _write_blobs() -> None:
+            for blob in blobs:
+                stdin.write(f'{blob}\n'.encode())
+            stdin.close()
+
+        # Write in another thread, to avoid filling both pipes.
+        writer = threading.Thread(target=_write_blobs)
+        writer.start()
+        while header := cat_file.stdout.readline():
+            blob, object_type, *size = header.decode().split()
+            if object_type == 'missing':
+                continue
+            content = cat_file.stdout.read(int(size[0]))
+            # Skip the new line after the content.
+            cat_file.stdout.read(1)
+            yield blob, content
+        writer.join()
+
+
+def _parse_all_todos(todo_lines: List[str]) -> Iterator[_TodoRef]:
     useless_folder_prefix = './'
-    for todo_line in _grep_all_todos(folder):
+    for todo_line in todo_lines:
         if todo_line.startswith(useless_folder_prefix):
             todo_line = todo_line[len(useless_folder_prefix):]
         if not todo_line.strip():
@@ -108,6 +326,177 @@ def _grep_and_parse_all_todos(folder: str) -> Iterator[_TodoRef]:
             yield line
 
 
+def _get_changed_todos(revision: str, folder: str) -> Tuple[List[_TodoRef], List[_TodoRef]]:
+    """List the TODOs in lines added and removed in a folder since a given revision.
+
+    Only the diff is parsed, so it scales with the size of the changes, not with the size of
+    the folder.
+    """
+
+    added_todos: List[_TodoRef] = []
+    removed_todos: List[_TodoRef] = []
+    with subprocess.Popen(
+            [
+                'git', '-c', 'core.quotePath=false', 'diff', '-U0', '--no-color', '--no-ext-diff',
+                # Renamed files are seen as removed and added, as in a full scan.
+                '--no-renames', '--no-prefix', '--relative', f'{revision}..HEAD', '--', folder,
+            ],
+            stdout=subprocess.PIPE, text=True, errors='replace') as diff:
+        assert diff.stdout
+        old_file = new_file = ''
+        old_line = new_line = 0
+        is_in_header = False
+        for diff_line in diff.stdout:
+            diff_line = diff_line.rstrip('\n')
+            if diff_line.startswith('diff --git '):
+                is_in_header = True
+            elif is_in_header:
+                if diff_line.startswith('--- '):
+                    old_file = diff_line[4:].rstrip('\t')
+                elif diff_line.startswith('+++ '):
+                    new_file = diff_line[4:].rstrip('\t')
+                elif match := _DIFF_HUNK_REGEX.match(diff_line):
+                    is_in_header = False
+                    old_line, new_line = (int(number) for number in match.groups())
+            elif match := _DIFF_HUNK_REGEX.match(diff_line):
+                old_line, new_line = (int(number) for number in match.groups())
+            elif diff_line.startswith('-'):
+                if _TODO_LINE_REGEX.search(diff_line):
+                    removed_todos.append(_TodoRef.from_text(old_file, old_line, diff_line[1:]))
+                old_line += 1
+            elif diff_line.startswith('+'):
+                if _TODO_LINE_REGEX.search(diff_line):
+                    added_todos.append(_TodoRef.from_text(new_file, new_line, diff_line[1:]))
+                new_line += 1
+    if diff.returncode:
+        raise subprocess.CalledProcessError(diff.returncode, diff.args)
+    return added_todos, removed_todos
+
+
+def _diff_todos(recent_todos: List[_TodoRef], old_todos: List[_TodoRef]) \
+        -> Tuple[List[_TodoRef], int]:
+    """Find the TODOs that were added, and count the ones that were removed.
+
+    TODOs are matched by file and text, counting duplicates: if a file had one TODO and now has
+    two identical ones, one of them is new.
+    """
+
+    old_counts = collections.Counter(old_todos)
+    new_todos: List[_TodoRef] = []
+    for todo in recent_todos:
+        if old_counts[todo]:
+            old_counts[todo] -= 1
+        else:
+            new_todos.append(todo)
+    return new_todos, sum(old_counts.values())
+
+
+class _SeriesPoint(typing.NamedTuple):
+    timestamp: int
+    # Number of TODOs by owner.
+    counts: Dict[str, int]
+
+
+def _count_todos_by_owner(todos: typing.Iterable[_TodoRef]) -> Dict[str, int]:
+    return collections.Counter(todo.owner or _NO_OWNER for todo in todos)
+
+
+def _get_series_timestamps(duration: str, interval_days: int) -> List[int]:
+    """List the times of the points of a series, every few days since a given duration ago."""
+
+    now = int(time.time())
+    # Let git parse the duration: this outputs "--max-age=<timestamp>".
+    since = int(_run_git(['rev-parse', f'--since={duration}']).split('=', 1)[1])
+    interval = interval_days * 86400
+    return list(range(now - (now - since) // interval * interval, now + 1, interval))
+
+
+def _get_todo_series(
+        base_revision: str, folder: str, timestamps: List[int], base_counts: Dict[str, int]) \
+        -> List[_SeriesPoint]:
+    """Count TODOs by owner at given times, from their count at a base revision.
+
+    The history since the base revision is walked only once, following first parents, and only
+    its diff is parsed, so it scales with the size of the changes, not with the number of points.
+    """
+
+    counts = collections.Counter(base_counts)
+    series: List[_SeriesPoint] = []
+    next_timestamps = collections.deque(sorted(timestamps))
+    with subprocess.Popen(
+            [
+                'git', '-c', 'core.quotePath=false', 'log', '--reverse', '--first-parent',
+                '--diff-merges=first-parent', '-p', '-U0', '--no-color', '--no-ext-diff',
+                '--no-renames', '--relative', '--format=%x00%ct',
+                f'{base_revision}..HEAD' if base_revision else 'HEAD', '--', folder,
+            ],
+            stdout=subprocess.PIPE, text=True, errors='replace') as log:
+        assert log.stdout
+        is_in_header = False
+        for log_line in log.stdout:
+            if log_line.startswith('\0'):
+                commit_timestamp = int(log_line[1:])
+                while next_timestamps and next_timestamps[0] < commit_timestamp:
+                    series.append(_SeriesPoint(next_timestamps.popleft(), dict(counts)))
+            elif log_line.startswith('diff --git '):
+                is_in_header = True
+            elif is_in_header:
+                is_in_header = not log_line.startswith('@@ ')
+            elif log_line[:1] in {'+', '-'} and _TODO_LINE_REGEX.search(log_line):
+                owner = _TodoRef.from_text('', 0, log_line[1:]).owner or _NO_OWNER
+                counts[owner] += 1 if log_line.startswith('+') else -1
+    if log.returncode:
+        raise subprocess.CalledProcessError(log.returncode, log.args)
+    series.extend(_SeriesPoint(timestamp, dict(counts)) for timestamp in next_timestamps)
+    return series
+
+
+def _format_date(timestamp: int) -> str:
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).date().isoformat()
+
+
+def _format_series(series: List[_SeriesPoint], series_format: str) -> str:
+    """Format a series of TODO counts as CSV or JSON."""
+
+    if series_format == 'json':
+        return json.dumps([
+            {
+                'date': _format_date(point.timestamp),
+                'owners': {owner: count for owner, count in sorted(point.counts.items()) if count},
+                'total': sum(point.counts.values()),
+            }
+            for point in series
+        ], indent=2)
+    import csv  # pylint: disable=import-outside-toplevel
+    import io  # pylint: disable=import-outside-toplevel
+
+    owners = sorted({owner for point in series for owner, count in point.counts.items() if count})
+    output = io.StringIO()
+    writer = csv.writer(output, lineterminator='\n')
+    writer.writerow(['date', 'total'] + owners)
+    for point in series:
+        writer.writerow(
+            [_format_date(point.timestamp), sum(point.counts.values())] +
+            [point.counts.get(owner, 0) for owner in owners])
+    return output.getvalue().rstrip('\n')
+
+
+def _make_slack_series_message(series: List[_SeriesPoint], duration: str) -> Dict[str, str]:
+    """Create a message that will be sent to slack about the TODO counts evolution."""
+
+    first, last = series[0].counts, series[-1].counts
+    first_total, last_total = sum(first.values()), sum(last.values())
+    top_owners = sorted(
+        (owner for owner, count in last.items() if count), key=lambda owner: -last[owner])
+    owner_lines = ''.join(
+        f'\n• {owner}: {last[owner]} ({last[owner] - first.get(owner, 0):+d})'
+        for owner in top_owners[:_SLACK_SERIES_MAX_OWNERS])
+    return {
+        'text': f'{_get_github_repo()} TODOs over the last {duration}: '
+        f'{first_total} → {last_total} ({last_total - first_total:+d}).' + owner_lines,
+    }
+
+
 def _make_message(new_todos: List[_TodoRef], closed_todos_count: int) -> str:
     """Create a message that will be shown about the TODO diff."""
 
@@ -127,11 +516,56 @@ def _make_slack_message(new_todos: List[_TodoRef], closed_todos_count: int, dura
 
     todos_added = '\n'.join(todo.format_for_slack() for todo in new_todos)
     return {
-        'text': f'{_PROJECT_USERNAME}/{_PROJECT_REPONAME} TODOs modifications since {duration}.\n'
+        'text': f'{_get_github_repo()} TODOs modifications since {duration}.\n'
         f'{closed_todos_count} TODOs removed\n{len(new_todos)} TODOs added:\n' + todos_added,
     }
 
 
+def _post_to_slack(message: Dict[str, str]) -> None:
+    slack_url = os.getenv('SLACK_INTEGRATION_URL')
+    if not slack_url:
+        return
+    import http_client  # pylint: disable=import-outside-toplevel
+
+    http_client.get_session(slack_url).post(slack_url, json=message)
+
+
+def _print_index_stats(index: _TodoIndex) -> None:
+    print(
+        f'TODO index: {index.cached_blobs_count} blobs from cache, '
+        f'{index.parsed_blobs_count} blobs parsed.', file=sys.stderr)
+
+
+def _print_series(args: argparse.Namespace) -> None:
+    # Start from the main branch, as the history is then walked following first parents.
+    base_revision = _run_git([
+        'log', '--first-parent', '--before', args.duration, '--format=%H', '-1'])
+    if not base_revision:
+        base_todos: typing.Iterable[_TodoRef] = []
+    elif args.index_cache:
+        index = _TodoIndex(args.index_cache)
+        try:
+            base_todos = list(index.get_revision_todos(base_revision, args.folder))
+        finally:
+            index.close()
+        if args.stats:
+            _print_index_stats(index)
+    else:
+        base_todos = _parse_all_todos(_git_grep_all_todos(base_revision, args.folder))
+    series = _get_todo_series(
+        base_revision, args.folder, _get_series_timestamps(args.duration, args.series_interval),
+        _count_todos_by_owner(base_todos))
+    print(_format_series(series, args.series))
+    _post_to_slack(_make_slack_series_message(series, args.duration))
+
+
+def _positive_int(value: str) -> int:
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f'{value} is not a positive integer.')
+    return number
+
+
 def main(string_args: Optional[List[str]] = None) -> None:
     """Compare previous TODOs from current branch's."""
 
@@ -143,23 +577,62 @@ def main(string_args: Optional[List[str]] = None) -> None:
     parser.add_argument(
         'folder', default='.', nargs='?',
         help='A subfolder of the current repo in which we look for the TODOs.')
+    parser.add_argument(
+        '--jobs', '-j', type=int,
+        help='Number of processes scanning files with --full-scan. Defaults to the number of CPUs.')
+    parser.add_argument(
+        '--full-scan', action='store_true',
+        help='Compare all the TODOs in the tracked files of the folder, in the working tree and in '
+        'the old revision, instead of only parsing the diff. Slower, but useful to cross-check '
+        'results.')
+    parser.add_argument('--index-cache', help='''
+        A file where to keep an index of TODOs by git blob, e.g. to be cached between CI runs.
+        If set, the full scan compares TODOs at HEAD and in the old revision, using this index.
+    ''')
+    parser.add_argument(
+        '--stats', action='store_true',
+        help='Report how many blobs were read from the index cache, and how many were parsed. '
+        'Requires --index-cache.')
+    parser.add_argument(
+        '--series', choices=('csv', 'json'),
+        help='Output the number of TODOs by owner at regular intervals over the duration, '
+        'instead of the TODOs that were added.')
+    parser.add_argument(
+        '--series-interval', type=_positive_int, default=7, metavar='DAYS',
+        help='Number of days between two points of the series (default: %(default)s).')
     args = parser.parse_args(string_args)
+    if args.stats and not args.index_cache:
+        parser.error('--stats is only available with --index-cache.')
+    if args.series and args.full_scan:
+        parser.error('--full-scan is not available with --series.')
+
+    if args.series:
+        _print_series(args)
+        return
 
     last_checked_commit = _run_git([
         'log', '--before', args.duration, '--format=%h', '-1', args.folder])
-    recent_todos = list(_grep_and_parse_all_todos(args.folder))
-    _run_git(['-c', 'advice.detachedHead=false', 'checkout', last_checked_commit])
-    old_todos = list(_grep_and_parse_all_todos(args.folder))
-    _run_git(['checkout', '-'])
-    new_todos = [todo for todo in recent_todos if todo not in old_todos]
-    closed_todos_count = sum(1 for todo in old_todos if todo not in recent_todos)
+    if args.index_cache:
+        index = _TodoIndex(args.index_cache)
+        try:
+            recent_todos = list(index.get_revision_todos('HEAD', args.folder))
+            old_todos = list(index.get_revision_todos(last_checked_commit, args.folder))
+        finally:
+            index.close()
+        if args.stats:
+            _print_index_stats(index)
+    elif args.full_scan:
+        recent_todos = list(_scan_all_todos(args.folder, args.jobs))
+        old_todos = list(_parse_all_todos(_git_grep_all_todos(last_checked_commit, args.folder)))
+    else:
+        recent_todos, old_todos = _get_changed_todos(last_checked_commit, args.folder)
+    new_todos, closed_todos_count = _diff_todos(recent_todos, old_todos)
     message = _make_message(new_todos, closed_todos_count)
     print(message)
-    if _SLACK_INTEGRATION_URL:
-        requests.post(
-            _SLACK_INTEGRATION_URL,
-            json=_make_slack_message(new_todos, closed_todos_count, args.duration))
+    _post_to_slack(_make_slack_message(new_todos, closed_todos_count, args.duration))
 
 
 if __name__ == '__main__':
+    import ci_daemon
+    ci_daemon.forward_to_daemon(__file__)
     main()
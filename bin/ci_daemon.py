@@ -0,0 +1,281 @@
+"""An optional daemon running the CI scripts, to avoid paying for startup on each call.
+
+When BAYES_CI_DAEMON is set, the first script call starts a daemon in the background, listening
+on a Unix socket (BAYES_CI_SOCKET, or one in a private temporary folder). Later calls forward
+their arguments, environment, working directory and standard streams to it, and get back its
+exit code. The daemon preloads the slow modules of the scripts, and keeps its imported modules
+and HTTP sessions warm between calls. It runs one command at a time, and stops after being idle
+for BAYES_CI_DAEMON_IDLE_SECONDS (10 min).
+
+If the socket is missing, or the daemon is busy with another command or not responding, scripts
+run in-process as usual.
+"""
+
+import argparse
+import contextlib
+import importlib
+import json
+import logging
+import os
+from os import path
+import runpy
+import socket
+import socketserver
+import stat
+import subprocess
+import sys
+import tempfile
+import threading
+import traceback
+import typing
+from typing import Any, Optional, Sequence
+
+_DEFAULT_IDLE_SECONDS = 600
+# How long to wait for the daemon to accept a command, before running it in-process.
+_ACCEPT_TIMEOUT_SECONDS = 5
+# The standard streams of a command, forwarded from the client.
+_STANDARD_FDS = (0, 1, 2)
+# Modules that scripts only import when needed, as they are slow to import.
+_PRELOADED_MODULES = ('http_client',)
+
+
+def _get_socket_path() -> str:
+    if socket_path := os.getenv('BAYES_CI_SOCKET'):
+        return socket_path
+    folder = path.join(tempfile.gettempdir(), f'bayes-ci-{os.getuid()}')
+    os.makedirs(folder, mode=0o700, exist_ok=True)
+    # The client sends its environment, with secrets, to the daemon: the folder must be private.
+    folder_stat = os.lstat(folder)
+    if not stat.S_ISDIR(folder_stat.st_mode) or folder_stat.st_uid != os.getuid() or \
+            stat.S_IMODE(folder_stat.st_mode) != 0o700:
+        raise _CannotForwardError(f'The folder "{folder}" is not private.')
+    return path.join(folder, 'daemon.sock')
+
+
+def _send(connection: socket.socket, message: dict[str, Any]) -> None:
+    connection.sendall(json.dumps(message).encode() + b'\n')
+
+
+def _run_script(script_path: str, argv: list[str]) -> int:
+    sys.argv = [script_path] + argv
+    try:
+        runpy.run_path(script_path, run_name='__main__')
+    except SystemExit as error:
+        if error.code is None or isinstance(error.code, int):
+            return error.code or 0
+        print(error.code, file=sys.stderr)
+        return 1
+    except Exception:  # pylint: disable=broad-except
+        traceback.print_exc()
+        return 1
+    finally:
+        # Log the summaries that a process would log when exiting.
+        if http_client := sys.modules.get('http_client'):
+            http_client.log_summary()
+    return 0
+
+
+@contextlib.contextmanager
+def _use_standard_fds(fds: Sequence[int]) -> typing.Iterator[None]:
+    """Use the given file descriptors as stdin, stdout and stderr, for subprocesses as well."""
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+    previous_fds = [os.dup(fd) for fd in _STANDARD_FDS]
+    try:
+        for fd, standard_fd in zip(fds, _STANDARD_FDS):
+            os.dup2(fd, standard_fd)
+        yield
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        for previous_fd, standard_fd in zip(previous_fds, _STANDARD_FDS):
+            os.dup2(previous_fd, standard_fd)
+            os.close(previous_fd)
+
+
+class _CommandHandler(socketserver.StreamRequestHandler):
+    """Run a script for a client, as if it was called in the client's context."""
+
+    server: '_DaemonServer'
+
+    def handle(self) -> None:
+        if not self.server.command_lock.acquire(blocking=False):
+            _send(self.connection, {'busy': True})
+            return
+        try:
+            _send(self.connection, {'ready': True})
+            unused_data, fds, unused_flags, unused_address = socket.recv_fds(
+                self.connection, 1, len(_STANDARD_FDS))
+            try:
+                line = self.rfile.readline()
+                if not line or len(fds) != len(_STANDARD_FDS):
+                    # The client gave up.
+                    return
+                exit_code = self._run(json.loads(line), fds)
+            finally:
+                for fd in fds:
+                    os.close(fd)
+            _send(self.connection, {'exit': exit_code})
+        finally:
+            self.server.command_lock.release()
+
+    def _run(self, request: dict[str, Any], fds: Sequence[int]) -> int:
+        previous_env = dict(os.environ)
+        previous_cwd = os.getcwd()
+        os.environ.clear()
+        os.environ.update(request['env'])
+        # The script must run here, instead of being forwarded again.
+        os.environ.pop('BAYES_CI_DAEMON', None)
+        try:
+            os.chdir(request['cwd'])
+            with _use_standard_fds(fds):
+                return _run_script(request['script'], request['argv'])
+        finally:
+            os.environ.clear()
+            os.environ.update(previous_env)
+            os.chdir(previous_cwd)
+            # Let the next script configure logging, as in a new process.
+            for handler in logging.root.handlers[:]:
+                logging.root.removeHandler(handler)
+            logging.root.setLevel(logging.WARNING)
+
+
+class _DaemonServer(socketserver.ThreadingUnixStreamServer):
+    """A server running one command at a time, until it's idle for too long.
+
+    Connections are handled in threads, so that clients are told right away when it's busy.
+    """
+
+    daemon_threads = True
+    is_idle = False
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.command_lock = threading.Lock()
+
+    def handle_timeout(self) -> None:
+        if self.command_lock.acquire(blocking=False):
+            self.command_lock.release()
+            self.is_idle = True
+
+
+class _CannotForwardError(Exception):
+    """The command cannot be run by the daemon, although it may be running."""
+
+
+def _get_standard_fds() -> list[int]:
+    try:
+        return [stream.fileno() for stream in (sys.stdin, sys.stdout, sys.stderr)]
+    except (AttributeError, OSError, ValueError) as error:
+        raise _CannotForwardError('The standard streams are not files.') from error
+
+
+def _forward(socket_path: str, script_path: str, argv: Sequence[str]) -> Optional[int]:
+    """Run a script in the daemon, with the same standard streams. Return its exit code.
+
+    Returns None if the daemon is not running, and raises _CannotForwardError if it cannot run
+    the command, e.g. because it is busy with another one.
+    """
+
+    fds = _get_standard_fds()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.settimeout(_ACCEPT_TIMEOUT_SECONDS)
+        try:
+            connection.connect(socket_path)
+        except OSError:
+            return None
+        messages = connection.makefile('r', encoding='utf-8')
+        try:
+            answer = json.loads(messages.readline() or '{}')
+        except (OSError, ValueError) as error:
+            raise _CannotForwardError('The daemon is not responding.') from error
+        if not answer.get('ready'):
+            raise _CannotForwardError('The daemon is busy.')
+        # The command itself may run for a long time.
+        connection.settimeout(None)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        socket.send_fds(connection, [b'\0'], fds)
+        _send(connection, {
+            'argv': list(argv),
+            'cwd': os.getcwd(),
+            'env': dict(os.environ),
+            'script': path.abspath(script_path),
+        })
+        for line in messages:
+            message = json.loads(line)
+            if 'exit' in message:
+                return typing.cast(int, message['exit'])
+    logging.warning('The CI daemon stopped while running the command.')
+    return 1
+
+
+def _start_daemon(socket_path: str) -> None:
+    subprocess.Popen(  # pylint: disable=consider-using-with
+        [sys.executable, path.abspath(__file__), '--socket', socket_path],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        cwd='/', start_new_session=True)
+
+
+def forward_to_daemon(script_path: str) -> None:
+    """Run the current call of a script in the daemon if possible, and exit with its code.
+
+    Returns if the script should rather run in-process.
+    """
+
+    if not os.getenv('BAYES_CI_DAEMON'):
+        return
+    try:
+        socket_path = _get_socket_path()
+        exit_code = _forward(socket_path, script_path, sys.argv[1:])
+    except _CannotForwardError as error:
+        logging.debug('Running in-process: %s', error)
+        return
+    if exit_code is None:
+        # Start the daemon for the next calls, and run this one in-process.
+        _start_daemon(socket_path)
+        return
+    sys.exit(exit_code)
+
+
+def serve(socket_path: str, idle_seconds: float = _DEFAULT_IDLE_SECONDS) -> None:
+    """Run scripts for clients connecting to the socket, until idle for too long."""
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        if not connection.connect_ex(socket_path):
+            logging.info('Another daemon is already listening on %s.', socket_path)
+            return
+    for module in _PRELOADED_MODULES:
+        importlib.import_module(module)
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(socket_path)
+    with _DaemonServer(socket_path, _CommandHandler) as server:
+        server.timeout = idle_seconds
+        try:
+            while not server.is_idle:
+                server.handle_request()
+        finally:
+            os.remove(socket_path)
+
+
+def main(string_args: Optional[Sequence[str]] = None) -> None:
+    """Run the daemon."""
+
+    parser = argparse.ArgumentParser(description='Run the CI scripts for thin clients.')
+    parser.add_argument(
+        '--socket', help='Where to listen. Defaults to a private folder in the temp folder.')
+    parser.add_argument(
+        '--idle-seconds', type=float,
+        default=float(os.getenv('BAYES_CI_DAEMON_IDLE_SECONDS', str(_DEFAULT_IDLE_SECONDS))),
+        help='Stop after not getting any command for this long.')
+    args = parser.parse_args(string_args)
+    try:
+        socket_path = args.socket or _get_socket_path()
+    except _CannotForwardError as error:
+        parser.error(str(error))
+    serve(socket_path, args.idle_seconds)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,32 +4,40 @@
 Assumes a CIRCLE CI context, with the following additional environment:
 - GITHUB_TOKEN: a Github token with status access on commits.
 It is available in bayesimpact org under the Slack context.
+
+Deployments can either be polled from Github API, or be notified by the deployment tooling: with
+--deployment-events-port, deployment_status webhook payloads POSTed on this local port are used as
+soon as they arrive.
 """
 
 import argparse
+from concurrent import futures
+from http import server
+import json
 import logging
 import os
 from os import path
+import queue
+import random
+import threading
 import time
 import typing
 from typing import Optional, Sequence, Set
 from urllib import parse
 
-import requests
-
 if typing.TYPE_CHECKING:
+    import requests
+
     import create_demo_statuses_types as types
 
-_STATUSES_URL = (
-    f'https://api.github.com/repos/{os.getenv("CIRCLE_PROJECT_USERNAME")}/'
-    f'{os.getenv("CIRCLE_PROJECT_REPONAME")}/statuses/{os.getenv("CIRCLE_SHA1")}')
-_GITHUB_TOKEN = os.getenv('GITHUB_TOKEN', '')
 _DEMO_CONTEXT_PREFIX = 'bayesimpact/demo-'
 
-_DEPLOYMENTS_GRAPHQL_QUERY = '''query($repo: String!, $owner: String!, $prNumber: Int!) {
+# The commit message is only needed once, see wait_for_deployment_urls.
+_DEPLOYMENTS_GRAPHQL_QUERY = '''query(
+    $repo: String!, $owner: String!, $prNumber: Int!, $withCommit: Boolean!) {
   repository(name: $repo, owner: $owner) {
     pullRequest(number: $prNumber) {
-      commits(last: 1) {
+      commits(last: 1) @include(if: $withCommit) {
         nodes {
           commit {
             messageBody
@@ -51,6 +59,8 @@ _DEPLOYMENTS_GRAPHQL_QUERY = '''query($repo: String!, $owner: String!, $prNumber
       }
     }
   }
+  # Used to schedule calls to the API, see http_client.
+  rateLimit { cost remaining resetAt }
 }'''
 
 
@@ -72,15 +82,36 @@ _WAITING_DEPLOYMENT_STATES: Set['types._DeploymentState'] = {
     'IN_PROGRESS',
     'WAITING',
 }
+# Maximum number of statuses being created at the same time.
+_MAX_STATUS_WORKERS = 8
+# How long to wait for deployments by default, in seconds.
+_DEFAULT_DEPLOYMENT_TIMEOUT = 600
+# How long to wait for deployment events before polling Github API, in seconds.
+_DEFAULT_DEPLOYMENT_EVENTS_TIMEOUT = 300
+_READY_DEPLOYMENT_EVENT_STATES: Set['types._RestDeploymentState'] = {'success'}
+_FAILED_DEPLOYMENT_EVENT_STATES: Set['types._RestDeploymentState'] = {'error', 'failure'}
+# Bounds of the interval between two checks of the deployments, in seconds.
+_MIN_POLL_INTERVAL = 2
+_MAX_POLL_INTERVAL = 30
+
+
+def _get_commit_api_url(endpoint: str) -> str:
+    return f'https://api.github.com/repos/{os.getenv("CIRCLE_PROJECT_USERNAME")}/' \
+        f'{os.getenv("CIRCLE_PROJECT_REPONAME")}/{endpoint}/{os.getenv("CIRCLE_SHA1")}'
+
+
+def _get_github_session() -> 'requests.Session':
+    import http_client  # pylint: disable=import-outside-toplevel
+
+    return http_client.github_session(os.getenv('GITHUB_TOKEN', ''))
 
 
 def create_demo_status(name: str, url: Optional[str]) -> None:
     """Create a Github status for the given demo."""
 
     state = 'success' if url else 'failure'
-    response = requests.post(_STATUSES_URL, headers={
+    response = _get_github_session().post(_get_commit_api_url('statuses'), headers={
         'Accept': 'application/vnd.github.machine-man-preview+json',
-        'Authorization': f'token {_GITHUB_TOKEN}',
     }, json={
         'state': state,
         'context': f'{_DEMO_CONTEXT_PREFIX}{name}',
@@ -89,8 +120,57 @@ def create_demo_status(name: str, url: Optional[str]) -> None:
     response.raise_for_status()
 
 
+def _get_existing_statuses() -> dict[str, tuple[str, Optional[str]]]:
+    """Get the state and target URL of the current statuses on the commit, by context."""
+
+    response = _get_github_session().get(
+        f'{_get_commit_api_url("commits")}/status', params={'per_page': 100})
+    response.raise_for_status()
+    combined_status: 'types._CombinedStatus' = response.json()
+    return {
+        status['context']: (status.get('state', ''), status.get('target_url'))
+        for status in combined_status.get('statuses', [])}
+
+
+def create_demo_statuses(demo_urls: dict[str, Optional[str]]) -> None:
+    """Create Github statuses for all given demos, unless they already exist."""
+
+    if not demo_urls:
+        return
+    existing_statuses = _get_existing_statuses()
+    missing_statuses = {
+        name: url for name, url in demo_urls.items()
+        if existing_statuses.get(f'{_DEMO_CONTEXT_PREFIX}{name}') !=
+        ('success' if url else 'failure', url or None)}
+    if len(missing_statuses) < len(demo_urls):
+        logging.info(
+            'Skipping %d demo statuses that already exist.',
+            len(demo_urls) - len(missing_statuses))
+    with futures.ThreadPoolExecutor(max_workers=_MAX_STATUS_WORKERS) as executor:
+        for creation in [
+                executor.submit(create_demo_status, name, url)
+                for name, url in missing_statuses.items()]:
+            creation.result()
+
+
+def _get_demo_path(commit_message: Optional[str]) -> Optional[str]:
+    """Find the demo path given in a commit message, if any."""
+
+    return next((
+        line.removeprefix('PATH=')
+        for line in (commit_message or '').split('\n')
+        if line.startswith('PATH=')), None)
+
+
 def wait_for_deployment_urls(
-        deployments: Set[str], max_retry: int = 10) -> dict[str, Optional[str]]:
+        deployments: Set[str], timeout: float = _DEFAULT_DEPLOYMENT_TIMEOUT) \
+        -> dict[str, Optional[str]]:
+    """Wait for the given deployments to be ready, and get their URLs.
+
+    Deployments are checked with an exponential backoff, until they are all ready or failed,
+    or until the timeout (in seconds) is reached.
+    """
+
     if not deployments:
         return {}
     deployments = set(deployments)
@@ -104,23 +184,30 @@ def wait_for_deployment_urls(
     if not owner or not repo or not token:
         return {}
     result: dict[str, Optional[str]] = {}
-    for unused_ in range(max_retry):
-        response = requests.post('https://api.github.com/graphql', json={
+    start = time.monotonic()
+    deadline = start + timeout
+    interval: float = _MIN_POLL_INTERVAL
+    url_path: Optional[str] = None
+    has_commit = False
+    while True:
+        response = _get_github_session().post('https://api.github.com/graphql', json={
             'query': _DEPLOYMENTS_GRAPHQL_QUERY,
             'variables': {
                 'owner': owner,
                 'prNumber': pr_number,
                 'repo': repo,
+                'withCommit': not has_commit,
             },
-        }, headers={'Authorization': f'token {token}'})
+        })
         response.raise_for_status()
         response_data: 'types._Response' = response.json()
         pull_request = response_data.get('data', {}).get('repository', {}).get('pullRequest', {})
-        url_path = next((
-            line.removeprefix('PATH=')
-            for pr_commit in pull_request.get('commits', {}).get('nodes', [])
-            for line in pr_commit.get('commit', {}).get('messageBody', '').split('\n')
-            if line.startswith('PATH=')), None)
+        if not has_commit:
+            url_path = next((
+                _get_demo_path(pr_commit.get('commit', {}).get('messageBody'))
+                for pr_commit in pull_request.get('commits', {}).get('nodes', [])), None)
+            has_commit = True
+        is_waiting = False
         for event in pull_request.get('timelineItems', {}).get('nodes', []):
             deployment = event.get('deployment', {})
             name = deployment.get('description', '').lower()
@@ -132,6 +219,7 @@ def wait_for_deployment_urls(
             if state in _FAILED_DEPLOYMENT_STATES:
                 result[name] = None
             if state in _WAITING_DEPLOYMENT_STATES:
+                is_waiting = True
                 break
             if state not in _READY_DEPLOYMENT_STATES:
                 continue
@@ -139,21 +227,140 @@ def wait_for_deployment_urls(
             if not url:
                 raise ValueError('Got a ready deployment without a URL...')
             result[name] = parse.urljoin(url, url_path or '')
-        else:
+        if not is_waiting:
+            # An older deployment may have failed before the latest one: only log final values.
+            for name in deployments & set(result):
+                _log_deployment(name, result[name], start)
             deployments -= set(result)
             if not deployments:
                 return result
-        time.sleep(2)
+        now = time.monotonic()
+        if now >= deadline:
+            break
+        # Sleep a random time in the second half of the interval, to avoid synchronized polls.
+        time.sleep(min(random.uniform(interval / 2, interval), deadline - now))
+        interval = min(interval * 2, _MAX_POLL_INTERVAL)
     logging.warning('Could not find deployment URLs for "%s"', '", "'.join(deployments))
     return result
 
 
+def _log_deployment(name: str, url: Optional[str], start: float) -> None:
+    logging.info(
+        'Deployment "%s" %s after %.1fs.', name, 'is ready' if url else 'failed',
+        time.monotonic() - start)
+
+
+class _DeploymentEventsHandler(server.BaseHTTPRequestHandler):
+    """Receive deployment_status webhook payloads."""
+
+    server: '_DeploymentEventsServer'
+
+    def do_POST(self) -> None:  # pylint: disable=invalid-name
+        """Queue a deployment_status event."""
+
+        try:
+            event = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        except ValueError:
+            self.send_error(400, 'Expected a JSON payload.')
+            return
+        if not isinstance(event, dict):
+            self.send_error(400, 'Expected a JSON object.')
+            return
+        self.server.events.put(typing.cast('types._DeploymentStatusEvent', event))
+        self.send_response(204)
+        self.end_headers()
+
+    # pylint: disable=redefined-builtin
+    def log_message(self, format: str, *args: typing.Any) -> None:
+        logging.debug(format, *args)
+
+
+class _DeploymentEventsServer(server.ThreadingHTTPServer):
+
+    def __init__(self, port: int) -> None:
+        super().__init__(('localhost', port), _DeploymentEventsHandler)
+        self.events: 'queue.Queue[types._DeploymentStatusEvent]' = queue.Queue()
+
+
+class DeploymentEventsReceiver:
+    """A local HTTP listener for deployment_status events, forwarded by the deployment tooling."""
+
+    def __init__(self, port: int = 0) -> None:
+        self._server = _DeploymentEventsServer(port)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    @property
+    def port(self) -> int:
+        """The port on which events are received."""
+
+        return self._server.server_address[1]
+
+    def close(self) -> None:
+        """Stop listening to events."""
+
+        self._server.shutdown()
+        self._server.server_close()
+
+    def wait_for_deployment_urls(self, deployments: Set[str], timeout: float) \
+            -> dict[str, Optional[str]]:
+        """Wait for events about the given deployments, and get their URLs.
+
+        Deployments for which no final event was received before the timeout (in seconds) are
+        missing from the result.
+        """
+
+        deployments = set(deployments)
+        result: dict[str, Optional[str]] = {}
+        start = time.monotonic()
+        deadline = start + timeout
+        url_paths: dict[str, Optional[str]] = {}
+        while deployments and (now := time.monotonic()) < deadline:
+            try:
+                event = self._server.events.get(timeout=deadline - now)
+            except queue.Empty:
+                break
+            # Github sends null fields, e.g. for deployments without any description.
+            deployment = event.get('deployment') or {}
+            name = (deployment.get('description') or '').lower()
+            if name not in deployments:
+                continue
+            status = event.get('deployment_status') or {}
+            state = status.get('state')
+            if state in _FAILED_DEPLOYMENT_EVENT_STATES:
+                result[name] = None
+            elif state in _READY_DEPLOYMENT_EVENT_STATES:
+                url = status.get('environment_url')
+                if not url:
+                    raise ValueError('Got a ready deployment without a URL...')
+                sha: str = deployment.get('sha') or os.getenv('CIRCLE_SHA1') or ''
+                if sha not in url_paths:
+                    url_paths[sha] = _get_commit_demo_path(sha)
+                result[name] = parse.urljoin(url, url_paths[sha] or '')
+            else:
+                continue
+            _log_deployment(name, result[name], start)
+            deployments.remove(name)
+        return result
+
+
+def _get_commit_demo_path(sha: str) -> Optional[str]:
+    owner = os.getenv('CIRCLE_PROJECT_USERNAME')
+    repo = os.getenv('CIRCLE_PROJECT_REPONAME')
+    if not sha or not owner or not repo:
+        return None
+    response = _get_github_session().get(
+        f'https://api.github.com/repos/{owner}/{repo}/commits/{sha}')
+    response.raise_for_status()
+    commit: 'types._RestCommit' = response.json()
+    return _get_demo_path(commit.get('commit', {}).get('message'))
+
+
 def main(string_args: Optional[Sequence[str]] = None) -> None:
     """Parse input arguments, and run the script."""
 
-    if not _GITHUB_TOKEN:
+    if not os.getenv('GITHUB_TOKEN'):
         raise ValueError('Need a Github token, please set GITHUB_TOKEN')
-    if 'None' in _STATUSES_URL:
+    if 'None' in _get_commit_api_url('statuses'):
         raise ValueError('This script should be run in a CircleCI environment.')
     parser = argparse.ArgumentParser(description='Add demo URLs in github statuses')
     parser.add_argument('--demo-url', '-u', help='''A demo URL to add.
@@ -167,16 +374,36 @@ def main(string_args: Optional[Sequence[str]] = None) -> None:
     ''')
     parser.add_argument('--deployment', dest='deployments', action='append', help='''
         Wait for GitHub deployment(s) to be ready, and link their URL''')
+    parser.add_argument(
+        '--deployment-timeout', type=float, default=_DEFAULT_DEPLOYMENT_TIMEOUT,
+        help='How long to wait for the deployments to be ready, in seconds.')
+    parser.add_argument('--deployment-events-port', type=int, help='''
+        Listen to deployment_status events POSTed on this local port, before polling Github for
+        the deployments that did not get any.''')
+    parser.add_argument(
+        '--deployment-events-timeout', type=float, default=_DEFAULT_DEPLOYMENT_EVENTS_TIMEOUT,
+        help='How long to wait for deployment events, in seconds.')
     args = parser.parse_args(string_args)
     demo_urls: dict[str, Optional[str]] = dict(args.demo_url or [])
     if args.directory:
         for filename in os.listdir(args.directory):
             with open(path.join(args.directory, filename)) as file:
                 demo_urls[filename] = file.read().strip()
-    demo_urls |= wait_for_deployment_urls({d.lower() for d in args.deployments or []})
-    for name, url in demo_urls.items():
-        create_demo_status(name, url)
+    deployments = {d.lower() for d in args.deployments or []}
+    if deployments and args.deployment_events_port is not None:
+        receiver = DeploymentEventsReceiver(args.deployment_events_port)
+        try:
+            demo_urls |= receiver.wait_for_deployment_urls(
+                deployments, timeout=args.deployment_events_timeout)
+        finally:
+            receiver.close()
+        deployments -= set(demo_urls)
+    demo_urls |= wait_for_deployment_urls(deployments, timeout=args.deployment_timeout)
+    create_demo_statuses(demo_urls)
 
 
 if __name__ == '__main__':
+    import ci_daemon
+    ci_daemon.forward_to_daemon(__file__)
+    logging.basicConfig(level=logging.INFO)
     main()
@@ -42,3 +42,33 @@ _PullRequest = TypedDict('_PullRequest', {
 _Repository = TypedDict('_Repository', {'pullRequest': _PullRequest})
 _Data = TypedDict('_Data', {'repository': _Repository}, total=False)
 _Response = TypedDict('_Response', {'data': _Data})
+
+# Webhook payload for a deployment_status event, see
+# https://docs.github.com/en/webhooks/webhook-events-and-payloads#deployment_status
+_RestDeploymentState = Literal[
+    'error',
+    'failure',
+    'in_progress',
+    'inactive',
+    'pending',
+    'queued',
+    'success',
+]
+_RestDeployment = TypedDict(
+    '_RestDeployment', {'description': Optional[str], 'sha': str}, total=False)
+_RestDeploymentStatus = TypedDict('_RestDeploymentStatus', {
+    'environment_url': str,
+    'state': _RestDeploymentState,
+}, total=False)
+_DeploymentStatusEvent = TypedDict('_DeploymentStatusEvent', {
+    'deployment': _RestDeployment,
+    'deployment_status': _RestDeploymentStatus,
+}, total=False)
+_RestCommitDetails = TypedDict('_RestCommitDetails', {'message': str})
+_RestCommit = TypedDict('_RestCommit', {'commit': _RestCommitDetails})
+_Status = TypedDict('_Status', {
+    'context': str,
+    'state': Literal['error', 'failure', 'pending', 'success'],
+    'target_url': Optional[str],
+}, total=False)
+_CombinedStatus = TypedDict('_CombinedStatus', {'statuses': list[_Status]}, total=False)
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""Start docker service containers for the CircleCI remote docker environment.
+
+In this environment volumes cannot be mounted from local folder (they can still be mounted between
+containers), so we need to copy files manually to fresh containers.
+See https://discuss.circleci.com/t/copying-files-to-docker-compose-container/12837
+
+Run using docker_compose_up_remote_env service [service…]
+(instead of: docker-compose up service…)
+Each service gets a container named service-$CIRCLE_BUILD_NUM. Containers are started one after
+the other, and then their volumes are copied and their entrypoints run in parallel. For backward
+compatibility, `docker_compose_up_remote_env service container_id` is also accepted, to name a
+single container.
+Containers are labelled with the build number, so that stop-dockers-from-compose-up-remote-env
+stops and removes them, and only them.
+
+Containers are kept alive by an idle shell, which exits (stopping the container) when it gets a
+SIGTERM or SIGINT (e.g. from docker stop), when the /tmp/.bayes-ci-stop file is created in the
+container, or after --max-lifetime seconds.
+
+With --sync, a service whose container is already running is not started again. Only the files
+which changed since the previous call are copied, using a manifest of the files' hashes kept in the
+container, and files removed locally are removed from the container.
+"""
+
+import argparse
+from concurrent import futures
+import copy
+import hashlib
+import io
+import json
+import logging
+import os
+from os import path
+import shlex
+import stat
+import subprocess
+import tarfile
+import typing
+from typing import Any, Callable, Iterator, NamedTuple, Optional, Sequence
+
+import yaml
+
+# Label of the containers we start, with the build number as value, to stop them at teardown.
+_BUILD_LABEL = 'bayes-ci.build'
+# Keep the container alive long enough for any job, unless asked otherwise.
+_DEFAULT_MAX_LIFETIME_SECONDS = 5 * 3600
+# The main process of the container: it has a signal handler, so that it stops on docker stop even
+# though it runs as PID 1. It waits for sleep in the background, to handle signals right away.
+_KEEP_ALIVE_SCRIPT = '''
+trap 'exit 0' TERM INT
+deadline=$(($(date +%s) + $1))
+while [ ! -e /tmp/.bayes-ci-stop ] && [ "$(date +%s)" -lt "$deadline" ]; do
+  sleep 1 & wait $!
+done
+'''
+# Where the files synced with --sync are listed in the container, with their state.
+_MANIFEST_PATH = '/.bayes-ci-volumes-manifest.json'
+
+
+class _Volume(NamedTuple):
+    # Path of the files to copy on the local file system.
+    source: str
+    # Path where to copy them in the container.
+    target: str
+
+
+def _is_local_path(source: str) -> bool:
+    return source.startswith(('.', '/', '~'))
+
+
+def _is_bind_volume(volume: Any) -> bool:
+    if isinstance(volume, dict):
+        return volume.get('type') == 'bind'
+    return ':' in volume and _is_local_path(volume.split(':', 1)[0])
+
+
+def _parse_volume(volume: Any) -> _Volume:
+    if isinstance(volume, dict):
+        source, target = volume['source'], volume['target']
+    else:
+        # Split ./frontend/cfg:/usr/app/cfg:ro into ./frontend/cfg and /usr/app/cfg
+        source, target = volume.split(':')[:2]
+    # Expand ~/cfg as docker-compose would.
+    return _Volume(path.expanduser(source), target)
+
+
+class _Service(NamedTuple):
+    name: str
+    container_id: str
+    volumes: list[_Volume]
+    entrypoint: list[str]
+
+
+def _get_service(compose: dict[str, Any], name: str, container_id: str) -> _Service:
+    try:
+        config = compose['services'][name]
+    except KeyError:
+        raise ValueError(f'No service "{name}" in the docker-compose file.') from None
+    entrypoint = config.get('entrypoint') or []
+    return _Service(
+        name, container_id,
+        [_parse_volume(volume) for volume in config.get('volumes', []) if _is_bind_volume(volume)],
+        shlex.split(entrypoint) if isinstance(entrypoint, str) else entrypoint)
+
+
+def _alter_compose(compose: dict[str, Any]) -> dict[str, Any]:
+    """Remove the volumes that cannot be mounted, and the entrypoints of all services."""
+
+    altered = copy.deepcopy(compose)
+    for config in altered.get('services', {}).values():
+        config.pop('entrypoint', None)
+        if 'volumes' in config:
+            config['volumes'] = [
+                volume for volume in config['volumes'] if not _is_bind_volume(volume)]
+            if not config['volumes']:
+                del config['volumes']
+    return altered
+
+
+def _as_root(tar_info: tarfile.TarInfo) -> tarfile.TarInfo:
+    # Files are owned by root in the container, as with docker cp.
+    tar_info.uid = tar_info.gid = 0
+    tar_info.uname = tar_info.gname = 'root'
+    return tar_info
+
+
+def _write_volumes_archive(
+        volumes: Sequence[_Volume], file: typing.IO[bytes], *, service: str = '') -> None:
+    """Write the files of all the volumes in a tar stream, with their path in the container."""
+
+    with tarfile.open(fileobj=file, mode='w|') as archive:
+        for volume in volumes:
+            if not path.exists(volume.source):
+                logging.warning(
+                    '%s: %s does not exist in the source file system.', service, volume.source)
+                continue
+            archive.add(volume.source, arcname=volume.target.lstrip('/'), filter=_as_root)
+
+
+def _iterate_volume_paths(
+        volumes: Sequence[_Volume], *, service: str = '') -> Iterator[tuple[str, str]]:
+    """Iterate over the local paths of all the volumes, with their path in the container.
+
+    Folders come before their content, and symbolic links are not followed.
+    """
+
+    for volume in volumes:
+        if not path.lexists(volume.source):
+            logging.warning(
+                '%s: %s does not exist in the source file system.', service, volume.source)
+            continue
+        target = volume.target.strip('/')
+        yield volume.source, target
+        if path.islink(volume.source) or not path.isdir(volume.source):
+            continue
+        for folder, folder_names, file_names in os.walk(volume.source):
+            folder_names.sort()
+            target_folder = path.normpath(path.join(target, path.relpath(folder, volume.source)))
+            for name in sorted(folder_names + file_names):
+                yield path.join(folder, name), path.join(target_folder, name)
+
+
+def _get_file_state(local_path: str, previous: Optional[dict[str, Any]]) -> dict[str, Any]:
+    """Get the state of a local file, only hashing its content if it was touched."""
+
+    stat_result = os.lstat(local_path)
+    state: dict[str, Any] = {
+        'mode': stat_result.st_mode,
+        'mtime': stat_result.st_mtime_ns,
+        'size': stat_result.st_size,
+    }
+    if previous and all(previous.get(key) == value for key, value in state.items()):
+        return previous
+    content_hash = hashlib.sha256()
+    if stat.S_ISLNK(stat_result.st_mode):
+        content_hash.update(os.readlink(local_path).encode())
+    elif stat.S_ISREG(stat_result.st_mode):
+        with open(local_path, 'rb') as file:
+            while chunk := file.read(1 << 20):
+                content_hash.update(chunk)
+    state['sha256'] = content_hash.hexdigest()
+    return state
+
+
+def _is_same_file(state: dict[str, Any], previous: Optional[dict[str, Any]]) -> bool:
+    return previous is not None and all(
+        state[key] == previous.get(key) for key in ('mode', 'sha256'))
+
+
+def _write_volumes_delta(
+        volumes: Sequence[_Volume], manifest: dict[str, Any], file: typing.IO[bytes], *,
+        service: str = '') -> list[str]:
+    """Write the files which changed since the manifest was written, and a new manifest.
+
+    Returns the paths in the container of the files that were removed from the volumes.
+    """
+
+    new_manifest: dict[str, Any] = {}
+    num_changed = 0
+    with tarfile.open(fileobj=file, mode='w|') as archive:
+        for local_path, name in _iterate_volume_paths(volumes, service=service):
+            previous = manifest.get(name)
+            state = _get_file_state(local_path, previous)
+            new_manifest[name] = state
+            if not _is_same_file(state, previous):
+                archive.add(local_path, arcname=name, recursive=False, filter=_as_root)
+                num_changed += 1
+        manifest_content = json.dumps(new_manifest).encode()
+        manifest_info = _as_root(tarfile.TarInfo(_MANIFEST_PATH.lstrip('/')))
+        manifest_info.size = len(manifest_content)
+        archive.addfile(manifest_info, io.BytesIO(manifest_content))
+    logging.info('%s: %d files out of %d changed.', service, num_changed, len(new_manifest))
+    return sorted(name for name in manifest if name not in new_manifest)
+
+
+def _is_container_running(container_id: str) -> bool:
+    inspect = subprocess.run(
+        ['docker', 'inspect', '-f', '{{.State.Running}}', container_id],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=False)
+    return not inspect.returncode and inspect.stdout.strip() == 'true'
+
+
+def _get_container_manifest(container_id: str) -> Optional[dict[str, Any]]:
+    """Get the manifest of the files synced in a container, if it exists."""
+
+    cat_manifest = subprocess.run(
+        ['docker', 'exec', container_id, 'cat', _MANIFEST_PATH],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=False)
+    if cat_manifest.returncode:
+        return None
+    return typing.cast(dict[str, Any], json.loads(cat_manifest.stdout))
+
+
+def _run(command: list[str], **kwargs: Any) -> None:
+    logging.info('+ %s', shlex.join(command))
+    subprocess.run(command, check=True, **kwargs)
+
+
+def _copy_to_container(container_id: str, write_archive: Callable[[typing.IO[bytes]], Any]) -> None:
+    # All files are streamed to the container in a single call, creating parent folders.
+    copy_command = ['docker', 'cp', '-', f'{container_id}:/']
+    logging.info('+ %s', shlex.join(copy_command))
+    with subprocess.Popen(copy_command, stdin=subprocess.PIPE) as docker_cp:
+        assert docker_cp.stdin
+        try:
+            write_archive(docker_cp.stdin)
+        finally:
+            docker_cp.stdin.close()
+    if docker_cp.returncode:
+        raise subprocess.CalledProcessError(docker_cp.returncode, copy_command)
+
+
+def _start_container(
+        service: _Service, altered_compose: str, build_num: str, max_lifetime: int, *,
+        sync: bool = False) -> bool:
+    """Start the container of a service, unless it can be reused. Return whether it was reused."""
+
+    if sync and _is_container_running(service.container_id):
+        logging.info(
+            'Container %s of service "%s" is already running.', service.container_id, service.name)
+        return True
+    logging.info(
+        'Start container %s of service "%s" on the CircleCI remote docker environment',
+        service.container_id, service.name)
+    _run([
+        'docker-compose', '-f', '-', '--project-directory', '.', 'run',
+        '--name', service.container_id, '--label', f'{_BUILD_LABEL}={build_num}',
+        '--no-deps', '-d', service.name,
+        '/bin/sh', '-c', _KEEP_ALIVE_SCRIPT, 'keep-alive', str(max_lifetime),
+    ], input=altered_compose.encode())
+    return False
+
+
+def _prepare_container(service: _Service, *, sync: bool = False, is_reused: bool = False) -> None:
+    """Copy the volumes of a service in its started container, and run its entrypoint."""
+
+    if service.volumes and not sync:
+        logging.info('%s: copy files declared as volumes.', service.name)
+        _copy_to_container(service.container_id, lambda file: _write_volumes_archive(
+            service.volumes, file, service=service.name))
+    elif service.volumes:
+        logging.info('%s: sync files declared as volumes.', service.name)
+        # Without a manifest, e.g. after a copy without sync, all files are synced.
+        manifest = _get_container_manifest(service.container_id) if is_reused else None
+        removed: list[str] = []
+        _copy_to_container(service.container_id, lambda file: removed.extend(
+            _write_volumes_delta(service.volumes, manifest or {}, file, service=service.name)))
+        if removed:
+            _run(['docker', 'exec', service.container_id, 'rm', '-rf', '--'] + [
+                f'/{name}' for name in reversed(removed)])
+
+    # Our entrypoint are actually commands that we want to run before the actual commands
+    # (as opposed to regular entrypoints) therefore it's OK to run it here.
+    if service.entrypoint:
+        logging.info('%s: run entrypoint.', service.name)
+        _run(['docker', 'exec', '-t', service.container_id] + service.entrypoint)
+    logging.info('Container %s is ready.', service.container_id)
+
+
+def _iterate_services(
+        compose: dict[str, Any], names: Sequence[str], build_num: str) -> Iterator[_Service]:
+    # Legacy usage: a service and the ID of its container.
+    if len(names) == 2 and names[1] not in compose.get('services', {}):
+        yield _get_service(compose, names[0], names[1])
+        return
+    for name in names:
+        yield _get_service(compose, name, f'{name}-{build_num}')
+
+
+def main(string_args: Optional[Sequence[str]] = None) -> None:
+    """Start the containers of the given services."""
+
+    parser = argparse.ArgumentParser(
+        description='Start docker service containers for the CircleCI remote docker environment.')
+    parser.add_argument('services', nargs='+', help='The services to start.')
+    parser.add_argument(
+        '--max-lifetime', type=int, default=int(os.getenv(
+            'BAYES_CI_KEEP_ALIVE_SECONDS', str(_DEFAULT_MAX_LIFETIME_SECONDS))),
+        help='Stop the containers after this many seconds, if not stopped before.')
+    parser.add_argument(
+        '--sync', action='store_true',
+        help='Reuse the containers if they are already running, and only copy the files that '
+        'changed since the last sync.')
+    args = parser.parse_args(string_args)
+
+    with open('docker-compose.yml') as file:
+        compose = yaml.safe_load(file)
+    build_num = os.getenv('CIRCLE_BUILD_NUM', '')
+    services = list(_iterate_services(compose, args.services, build_num))
+    altered_compose = yaml.safe_dump(_alter_compose(compose))
+    # Containers are started one at a time, as concurrent calls to docker-compose would all try to
+    # create the project's network, and all but one would fail.
+    reused_containers = [
+        _start_container(
+            service, altered_compose, build_num, args.max_lifetime, sync=args.sync)
+        for service in services]
+    with futures.ThreadPoolExecutor(max_workers=len(services)) as executor:
+        preparations = [
+            executor.submit(_prepare_container, service, sync=args.sync, is_reused=is_reused)
+            for service, is_reused in zip(services, reused_containers)]
+        errors = [
+            (service, error) for service, preparation in zip(services, preparations)
+            if (error := preparation.exception())]
+    for service, error in errors:
+        logging.error('Unable to prepare the service "%s".', service.name, exc_info=error)
+    if errors:
+        raise errors[0][1]
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    main()
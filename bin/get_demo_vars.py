@@ -4,19 +4,31 @@
  Assumes that it is run in CircleCI context,
  in particular it has access to CircleCI environment variables:
  https://circleci.com/docs/2.0/env-vars/#built-in-environment-variables.
+
+ Variables are computed once per build and cached in a temporary file (in DEMO_VARS_CACHE_DIR if
+ set), so that calling it for each variable is cheap. The demo approval of a workflow is cached
+ the same way.
 """
 
 import argparse
+import hashlib
+import json
 import logging
 import os
 import re
+import shlex
 import subprocess
-from typing import Iterator, Mapping, Optional, Tuple
+import tempfile
+import typing
+from typing import Any, Iterator, Mapping, Optional, Tuple
 from urllib import parse
 
-import requests
+if typing.TYPE_CHECKING:
+    import requests
 
 _VARIABLE_LINE_REGEX = re.compile(r'^\w+=')
+# Prefix of the variables in the env format.
+_ENV_PREFIX = 'DEMO_'
 
 
 def _run_git(*command: str) -> str:
@@ -32,32 +44,71 @@ def _get_commit_variables() -> dict[str, str]:
         for name, value in (line.split('=', 1),)}
 
 
-def _get_callback_url(env: Mapping[str, str]) -> Optional[str]:
+def _iterate_workflow_jobs(session: 'requests.Session', workflow_api: str) \
+        -> Iterator[dict[str, Any]]:
+    """Iterate over the jobs of a workflow, fetching pages only as needed."""
+
+    # https://circleci.com/docs/api/v2/#operation/listWorkflowJobs
+    page_token: Optional[str] = None
+    while True:
+        response = session.get(
+            f'{workflow_api}/job', params={'page-token': page_token} if page_token else None)
+        response.raise_for_status()
+        page = response.json()
+        yield from page.get('items', [])
+        page_token = page.get('next_page_token')
+        if not page_token:
+            return
+
+
+def _find_approval_id(session: 'requests.Session', workflow_api: str) -> Optional[str]:
+    return next((
+        job['approval_request_id']
+        for job in _iterate_workflow_jobs(session, workflow_api)
+        if job.get('type') == 'approval'
+        if job.get('name') == 'wait-for-demo'), None)
+
+
+def _get_callback_url(env: Mapping[str, str]) -> tuple[Optional[str], bool]:
+    """Get the URL to approve the demo, and whether it can be cached for the build."""
+
     workflow_id = env.get('CIRCLE_WORKFLOW_ID')
     if not workflow_id:
         logging.info('Missing a workflow ID, no callback_url available.')
-        return None
-    circle_token = env.get('CIRCLE_API_TOKEN')
-    if not circle_token:
-        logging.warning('Missing a CircleCI API token. Please set CIRCLE_API_TOKEN')
-        return None
+        return None, True
     workflow_api = f'https://circleci.com/api/v2/workflow/{workflow_id}'
-    # https://circleci.com/docs/api/v2/#operation/listWorkflowJobs
-    response = requests.get(f'{workflow_api}/job', headers={'Circle-Token': circle_token})
-    approval_id = next((
-        item['approval_request_id']
-        for item in response.json().get('items', [])
-        if item.get('type') == 'approval'
-        if item.get('name') == 'wait-for-demo'), None)
-    return f'{workflow_api}/approve/{approval_id}' if approval_id else None
-
-
-def _get_variables(env: Mapping[str, str]) -> Iterator[Tuple[str, str]]:
+    # The jobs of a workflow do not change, so the approval is only looked up once per workflow.
+    cache_path = _get_cache_path(env, 'approval', workflow_id)
+    try:
+        with open(cache_path) as cache_file:
+            approval_id = json.load(cache_file)['approval_id']
+    except (OSError, ValueError, KeyError):
+        circle_token = env.get('CIRCLE_API_TOKEN')
+        if not circle_token:
+            logging.warning('Missing a CircleCI API token. Please set CIRCLE_API_TOKEN')
+            return None, True
+        # pylint: disable=import-outside-toplevel
+        import requests
+        import http_client
+
+        session = http_client.get_session(workflow_api, {'Circle-Token': circle_token})
+        try:
+            approval_id = _find_approval_id(session, workflow_api)
+        except requests.HTTPError as error:
+            logging.warning('Unable to list the jobs of the workflow: %s', error)
+            # The API may answer on the next call.
+            return None, False
+        _write_cache(cache_path, {'approval_id': approval_id})
+    return f'{workflow_api}/approve/{approval_id}' if approval_id else None, True
+
+
+def _get_variables(env: Mapping[str, str], callback_url: Optional[str]) \
+        -> Iterator[Tuple[str, str]]:
     branch = env.get('CIRCLE_BRANCH')
     tag = env.get('CIRCLE_TAG')
     github_user = env.get('CIRCLE_PROJECT_USERNAME')
     github_repo = env.get('CIRCLE_PROJECT_REPONAME')
-    if callback_url := _get_callback_url(env):
+    if callback_url:
         yield 'ci_callback_url', callback_url
     if tag or branch == 'main':
         return
@@ -72,14 +123,70 @@ def _get_variables(env: Mapping[str, str]) -> Iterator[Tuple[str, str]]:
         yield 'override', f'{key}:{value}'
 
 
+def _get_cache_path(env: Mapping[str, str], kind: str, *keys: str) -> str:
+    """Get the file caching some values for the given keys."""
+
+    key = hashlib.sha256(':'.join(keys).encode()).hexdigest()[:16]
+    cache_dir = env.get('DEMO_VARS_CACHE_DIR') or tempfile.gettempdir()
+    return os.path.join(cache_dir, f'demo-{kind}-{key}.json')
+
+
+def _write_cache(cache_path: str, value: Any) -> None:
+    with open(f'{cache_path}.{os.getpid()}', 'w') as cache_file:
+        json.dump(value, cache_file)
+    os.replace(f'{cache_path}.{os.getpid()}', cache_path)
+
+
+def _get_all_variables(env: Mapping[str, str]) -> list[tuple[str, str]]:
+    """Get all the variables, computing them only once per build."""
+
+    sha1 = env.get('CIRCLE_SHA1')
+    workflow_id = env.get('CIRCLE_WORKFLOW_ID')
+    if not sha1 or not workflow_id:
+        # The build cannot be identified.
+        return list(_get_variables(env, _get_callback_url(env)[0]))
+    cache_path = _get_cache_path(env, 'vars', sha1, workflow_id)
+    try:
+        with open(cache_path) as cache_file:
+            return [(name, value) for name, value in json.load(cache_file)]
+    except (OSError, ValueError):
+        pass
+    callback_url, is_cacheable = _get_callback_url(env)
+    all_variables = list(_get_variables(env, callback_url))
+    if is_cacheable:
+        _write_cache(cache_path, all_variables)
+    return all_variables
+
+
+def _format_env(variables: list[tuple[str, str]]) -> str:
+    """Format variables as shell assignments, joining the values of repeated variables."""
+
+    values: dict[str, list[str]] = {}
+    for name, value in variables:
+        values.setdefault(name, []).append(value)
+    return '\n'.join(
+        f'{_ENV_PREFIX}{name.upper()}=' + shlex.quote('\n'.join(name_values))
+        for name, name_values in values.items())
+
+
 # TODO(cyrille): Move all CIRCLE context to CLI arguments.
 def main(string_args: Optional[list[str]] = None, env: Optional[dict[str, str]] = None) -> str:
     """Decide how the demo vars should be returned."""
 
     parser = argparse.ArgumentParser(description='Get all variables needed for the demos.')
     parser.add_argument('variable', nargs='?', help='Return only the specified variable.')
+    parser.add_argument(
+        '--format', choices=('query', 'env'), default='query',
+        help='How to return the variables: as a URL query string (default), or as shell '
+        'assignments to source, prefixed with DEMO_. The env format also sets DEMO_VARS to the '
+        'query string.')
     args = parser.parse_args(string_args)
-    all_variables = list(_get_variables(env or os.environ))
+    all_variables = _get_all_variables(env or os.environ)
+    if args.format == 'env':
+        if args.variable:
+            return _format_env([
+                (name, value) for name, value in all_variables if name == args.variable])
+        return _format_env(all_variables + [('vars', parse.urlencode(all_variables))])
     if args.variable:
         by_key = dict(all_variables)
         return by_key.get(args.variable, '')
@@ -87,4 +194,6 @@ def main(string_args: Optional[list[str]] = None, env: Optional[dict[str, str]]
 
 
 if __name__ == '__main__':
+    import ci_daemon
+    ci_daemon.forward_to_daemon(__file__)
     print(main())
@@ -0,0 +1,353 @@
+"""Shared HTTP sessions for the CI scripts.
+
+Sessions are pooled per host and per auth headers, so that successive calls to the same API reuse
+their connections. They retry with an exponential backoff on server errors, and on Github
+secondary rate limits (403 with a Retry-After header).
+
+Calls to Github API are also scheduled according to the remaining rate limit budget, as the token
+may be shared with other jobs: they get spread until the reset time when the budget runs low.
+
+If the GITHUB_CACHE_DIR environment variable is set, GET responses from Github API are cached in
+this folder, and revalidated with conditional requests (which do not count against the rate
+limit). The size of the cache is bounded by GITHUB_CACHE_MAX_MB (50MB by default).
+
+Importing this module, and requests, is slow: scripts only import them where they are needed, so
+that calls exiting early stay fast.
+"""
+
+import atexit
+import datetime
+import functools
+import hashlib
+import json
+import logging
+import os
+from os import path
+import threading
+import time
+from typing import Any, Mapping, NamedTuple, Optional, cast
+from urllib import parse
+
+import requests
+from requests import adapters
+from requests import structures
+from urllib3 import util
+
+# Maximum number of connections kept alive for each host.
+_POOL_SIZE = 8
+# Number of retries on server errors, waiting 1s, 2s, 4s, … in between.
+_MAX_RETRIES = 4
+_BACKOFF_FACTOR = 1
+
+_GITHUB_API_ORIGIN = 'https://api.github.com'
+# Start spreading calls when less than this ratio of the rate limit is left.
+_THROTTLE_RATIO = .1
+# Never wait longer than this for the rate limit to reset, rather let the call fail.
+_MAX_WAIT_SECONDS = 600
+_DEFAULT_CACHE_MAX_MB = 50
+# Headers that do not apply anymore to the cached content, since it's already decoded.
+_UNCACHED_HEADERS = frozenset({'content-encoding', 'content-length', 'transfer-encoding'})
+
+
+class _Retry(util.Retry):
+    """A retry policy that honors Retry-After on Github's secondary rate limits."""
+
+    # Github answers with a 403 and a Retry-After header when hitting a secondary rate limit.
+    RETRY_AFTER_STATUS_CODES = frozenset({403, 413, 429, 503})
+
+
+class _RateLimit:
+    """The known state of one of Github rate limits (core, search, graphql…)."""
+
+    def __init__(self) -> None:
+        self.limit = 0
+        self.remaining = 0
+        self.reset_at = 0.
+
+    def get_delay(self, now: float) -> float:
+        """Time to wait before the next call, to spread the remaining budget until reset."""
+
+        if now >= self.reset_at or self.remaining > self.limit * _THROTTLE_RATIO:
+            return 0
+        delay = (self.reset_at - now) / (self.remaining + 1)
+        if delay > _MAX_WAIT_SECONDS:
+            logging.warning(
+                'Github rate limit is exhausted until %s.', time.ctime(self.reset_at))
+            return 0
+        return delay
+
+
+def _get_rate_limit_resource(url: str) -> str:
+    url_path = parse.urlsplit(url).path
+    if url_path == '/graphql':
+        return 'graphql'
+    if url_path.startswith('/search/'):
+        return 'search'
+    return 'core'
+
+
+class _GithubScheduler:
+    """Keep track of the Github rate limits, and throttle calls before they run out."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._rate_limits: dict[str, _RateLimit] = {}
+        self.calls = 0
+        self.points = 0
+        self.waited_seconds = 0.
+
+    def wait_for_budget(self, resource: str) -> None:
+        """Sleep if needed before calling an endpoint using the given resource."""
+
+        with self._lock:
+            rate_limit = self._rate_limits.get(resource)
+            delay = rate_limit.get_delay(time.time()) if rate_limit else 0
+            self.waited_seconds += delay
+        if delay:
+            logging.info('Waiting %.1fs for Github %s rate limit.', delay, resource)
+            time.sleep(delay)
+
+    def record(self, resource: str, response: requests.Response) -> None:
+        """Update the budget from a response's headers and content."""
+
+        headers = response.headers
+        resource = headers.get('X-RateLimit-Resource', resource)
+        # Conditional requests answered with "304 Not Modified" are free.
+        points = 0 if response.status_code == 304 else 1
+        remaining = headers.get('X-RateLimit-Remaining')
+        reset_at: Optional[float] = float(headers.get('X-RateLimit-Reset', 0)) or None
+        if resource == 'graphql' and response.ok:
+            graphql_rate_limit = _get_graphql_rate_limit(response)
+            points = graphql_rate_limit.get('cost', points)
+            remaining = graphql_rate_limit.get('remaining', remaining)
+            if reset_string := graphql_rate_limit.get('resetAt'):
+                reset_at = datetime.datetime.fromisoformat(
+                    reset_string.replace('Z', '+00:00')).timestamp()
+        with self._lock:
+            self.calls += 1
+            self.points += points
+            if remaining is None or not reset_at:
+                return
+            rate_limit = self._rate_limits.setdefault(resource, _RateLimit())
+            rate_limit.limit = int(headers.get('X-RateLimit-Limit', rate_limit.limit))
+            rate_limit.remaining = int(remaining)
+            rate_limit.reset_at = reset_at
+
+    def log_summary(self) -> None:
+        """Log how much of the budget was used since the last summary."""
+
+        with self._lock:
+            calls, points, waited_seconds = self.calls, self.points, self.waited_seconds
+            self.calls = self.points = 0
+            self.waited_seconds = 0.
+        if not calls:
+            return
+        logging.info(
+            'Github API: %d calls made, %d points spent, %.1fs spent waiting for rate limits.',
+            calls, points, waited_seconds)
+
+
+def _get_graphql_rate_limit(response: requests.Response) -> dict[str, Any]:
+    try:
+        return response.json().get('data', {}).get('rateLimit') or {}
+    except ValueError:
+        return {}
+
+
+_GITHUB_SCHEDULER = _GithubScheduler()
+
+
+class _CacheEntry(NamedTuple):
+    headers: dict[str, str]
+    content: bytes
+
+    def get_validators(self) -> dict[str, str]:
+        """Headers to send to revalidate this entry with a conditional request."""
+
+        validators: dict[str, str] = {}
+        if etag := self.headers.get('ETag'):
+            validators['If-None-Match'] = etag
+        if last_modified := self.headers.get('Last-Modified'):
+            validators['If-Modified-Since'] = last_modified
+        return validators
+
+
+class _HttpCache:
+    """An on-disk cache of responses, keyed by request, with a bounded size."""
+
+    def __init__(self, folder: str, max_bytes: int) -> None:
+        self._folder = folder
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(folder, exist_ok=True)
+
+    def _get_path(self, key: str) -> str:
+        return path.join(self._folder, hashlib.sha256(key.encode()).hexdigest())
+
+    def load(self, key: str) -> Optional[_CacheEntry]:
+        """Load a cached response if any."""
+
+        try:
+            with open(self._get_path(key), 'rb') as file:
+                headers = json.loads(file.readline())
+                return _CacheEntry(headers, file.read())
+        except (OSError, ValueError):
+            return None
+
+    def update(
+            self, key: str, entry: Optional[_CacheEntry], response: requests.Response) \
+            -> requests.Response:
+        """Serve the cached response on a 304, or save the new response."""
+
+        if response.status_code == 304 and entry:
+            with self._lock:
+                self.hits += 1
+            # Mark the entry as recently used.
+            os.utime(self._get_path(key))
+            headers = structures.CaseInsensitiveDict(entry.headers)
+            headers.update({
+                name: value for name, value in response.headers.items()
+                if name.lower().startswith('x-ratelimit-')})
+            response.status_code = 200
+            response.headers = headers
+            response._content = entry.content  # pylint: disable=protected-access
+            return response
+        with self._lock:
+            self.misses += 1
+        if response.status_code != 200 or not (
+                'ETag' in response.headers or 'Last-Modified' in response.headers):
+            return response
+        cached_headers = {
+            name: value for name, value in response.headers.items()
+            if name.lower() not in _UNCACHED_HEADERS}
+        file_path = self._get_path(key)
+        with open(f'{file_path}.tmp', 'wb') as file:
+            file.write(json.dumps(cached_headers).encode() + b'\n')
+            file.write(response.content)
+        os.replace(f'{file_path}.tmp', file_path)
+        self._evict()
+        return response
+
+    def _evict(self) -> None:
+        with self._lock:
+            entries = sorted(
+                (entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                for entry in os.scandir(self._folder) if entry.is_file())
+            total_size = sum(size for unused_mtime, size, unused_path in entries)
+            for unused_mtime, size, file_path in entries:
+                if total_size <= self._max_bytes:
+                    return
+                try:
+                    os.remove(file_path)
+                except FileNotFoundError:
+                    pass
+                total_size -= size
+
+    def log_summary(self) -> None:
+        """Log the cache hit rate since the last summary."""
+
+        with self._lock:
+            hits, total = self.hits, self.hits + self.misses
+            self.hits = self.misses = 0
+        if total:
+            logging.info(
+                'Github cache: %d hits out of %d requests (%d%%).',
+                hits, total, hits * 100 // total)
+
+
+# Caches of Github responses, by folder and maximum size.
+_GITHUB_CACHES: dict[tuple[str, int], _HttpCache] = {}
+_GITHUB_CACHES_LOCK = threading.Lock()
+
+
+def _get_github_cache() -> Optional[_HttpCache]:
+    # The environment is read on each call: it may change between commands run by the CI daemon.
+    folder = os.getenv('GITHUB_CACHE_DIR')
+    if not folder:
+        return None
+    max_mb = int(os.getenv('GITHUB_CACHE_MAX_MB', str(_DEFAULT_CACHE_MAX_MB)))
+    key = (folder, max_mb * 1024 * 1024)
+    with _GITHUB_CACHES_LOCK:
+        if key not in _GITHUB_CACHES:
+            _GITHUB_CACHES[key] = _HttpCache(*key)
+        return _GITHUB_CACHES[key]
+
+
+class _GithubSession(requests.Session):
+    """A session that schedules its calls according to Github rate limits, and caches them."""
+
+    def request(  # type: ignore[override]
+            self, method: str, url: str, *args: Any, **kwargs: Any) -> requests.Response:
+        resource = _get_rate_limit_resource(url)
+        cache = _get_github_cache() if method.upper() == 'GET' else None
+        if cache:
+            prepared = self.prepare_request(requests.Request(
+                method, url, params=kwargs.get('params'), headers=kwargs.get('headers')))
+            cache_key = '\n'.join((
+                prepared.url or url, cast(str, prepared.headers.get('Accept', '')),
+                cast(str, prepared.headers.get('Authorization', ''))))
+            if entry := cache.load(cache_key):
+                kwargs['headers'] = entry.get_validators() | (kwargs.get('headers') or {})
+        _GITHUB_SCHEDULER.wait_for_budget(resource)
+        response = super().request(method, url, *args, **kwargs)
+        _GITHUB_SCHEDULER.record(resource, response)
+        if cache:
+            return cache.update(cache_key, entry, response)
+        return response
+
+
+@functools.lru_cache(maxsize=None)
+def _get_session(origin: str, headers: tuple[tuple[str, str], ...]) -> requests.Session:
+    if origin == _GITHUB_API_ORIGIN:
+        session: requests.Session = _GithubSession()
+    else:
+        session = requests.Session()
+    session.headers.update(headers)
+    retry = _Retry(
+        total=_MAX_RETRIES, backoff_factor=_BACKOFF_FACTOR,
+        status_forcelist=frozenset({500, 502, 503, 504}),
+        # GraphQL queries are POSTs, and our writes to Github (commit statuses) can be repeated.
+        # Other POSTs, such as Slack messages, must not be sent twice.
+        allowed_methods=None if origin == _GITHUB_API_ORIGIN else _Retry.DEFAULT_ALLOWED_METHODS,
+        # Let the caller check the status of the last response.
+        raise_on_status=False)
+    session.mount(
+        f'{origin}/',
+        adapters.HTTPAdapter(pool_connections=1, pool_maxsize=_POOL_SIZE, max_retries=retry))
+    return session
+
+
+def get_session(url: str, headers: Optional[Mapping[str, str]] = None) -> requests.Session:
+    """Get a pooled session for the host of the given URL, with the given default headers."""
+
+    parsed = parse.urlsplit(url)
+    return _get_session(
+        f'{parsed.scheme}://{parsed.netloc}', tuple(sorted((headers or {}).items())))
+
+
+def github_session(token: str) -> requests.Session:
+    """Get a pooled session for Github API, authenticated with the given token."""
+
+    return get_session(_GITHUB_API_ORIGIN, {
+        'Accept': 'application/vnd.github.v3+json',
+        'Authorization': f'token {token}',
+    })
+
+
+def log_summary() -> None:
+    """Log the usage of Github API since the last summary.
+
+    This is done when the process exits, and should also be done at the end of each command when
+    several commands run in the same process.
+    """
+
+    _GITHUB_SCHEDULER.log_summary()
+    with _GITHUB_CACHES_LOCK:
+        caches = list(_GITHUB_CACHES.values())
+    for cache in caches:
+        cache.log_summary()
+
+
+atexit.register(log_summary)
@@ -10,15 +10,19 @@ Those are available in bayesimpact org under the Slack context.
 """
 
 import argparse
+from concurrent import futures
 import datetime
+import itertools
 import json
 import logging
 import os
 from os import path
 import typing
-from typing import Any, Literal, Generic, NamedTuple, Optional, Protocol, Sequence, TypedDict
+from typing import Any, Iterator, Literal, Generic, NamedTuple, Optional, Protocol, Sequence, \
+    TypedDict
 
-import requests
+if typing.TYPE_CHECKING:
+    import requests
 
 
 class _Config(NamedTuple):
@@ -128,38 +132,54 @@ class _Connection(Protocol, Generic[_T]):
         pass
 
 
-# GraphQL query for information about a Pull Request.
+# GraphQL fragment for information about a Pull Request.
 # Relevant information:
 #   - on the last commit of the PR:
 #       - global status state
 #       - demo URL from the bayesimpact/demo-frontend status
 # See https://docs.github.com/en/graphql for the full reference.
-_PULL_REQUEST_INFO_GRAPHQL_QUERY = '''query($prNodeId: ID!) {
-    node(id: $prNodeId) {
-        ... on PullRequest {
-            # Take the last commit.
-            commits(last:1) {
-                nodes {
-                    commit {
-                        # Look at its status checks.
-                        statusCheckRollup {
-                            contexts(last:100) {
-                                nodes {
-                                    ... on StatusContext {
-                                        context
-                                        targetUrl
-                                    }
-                                }
+_PULL_REQUEST_INFO_GRAPHQL_FRAGMENT = '''fragment pullRequestInfo on PullRequest {
+    # Take the last commit.
+    commits(last:1) {
+        nodes {
+            commit {
+                # Look at its status checks.
+                statusCheckRollup {
+                    contexts(last:100) {
+                        nodes {
+                            ... on StatusContext {
+                                context
+                                targetUrl
                             }
-                            # Aggregated state for statuses may be PENDING, FAILURE or SUCCESS.
-                            state
                         }
                     }
+                    # Aggregated state for statuses may be PENDING, FAILURE or SUCCESS.
+                    state
                 }
             }
         }
     }
 }'''
+# GraphQL query for information about a single Pull Request.
+_PULL_REQUEST_INFO_GRAPHQL_QUERY = '''query($prNodeId: ID!) {
+    node(id: $prNodeId) {
+        ...pullRequestInfo
+    }
+    # Used to schedule calls to the API, see http_client.
+    rateLimit { cost remaining resetAt }
+}
+''' + _PULL_REQUEST_INFO_GRAPHQL_FRAGMENT
+# GraphQL query for information about several Pull Requests at once.
+# Nodes are returned in the same order as the given IDs.
+_PULL_REQUESTS_INFO_GRAPHQL_QUERY = '''query($prNodeIds: [ID!]!) {
+    nodes(ids: $prNodeIds) {
+        ...pullRequestInfo
+    }
+    rateLimit { cost remaining resetAt }
+}
+''' + _PULL_REQUEST_INFO_GRAPHQL_FRAGMENT
+# Github does not accept more than 100 IDs in a nodes query.
+_GRAPHQL_BATCH_SIZE = 100
 # TODO(cyrille): Generate those from the query in a separated lib.
 _Context = TypedDict('_Context', {'context': str, 'targetUrl': str}, total=False)
 _StatusState = Literal['ERROR', 'EXPECTED', 'FAILURE', 'PENDING', 'SUCCESS']
@@ -172,6 +192,8 @@ _PRCommit = TypedDict('_PRCommit', {'commit': _Commit})
 _PullRequest = TypedDict('_PullRequest', {'commits': _Connection[_PRCommit]})
 _Node = TypedDict('_Node', {'node': _PullRequest}, total=False)
 _Response = TypedDict('_Response', {'data': _Node})
+_Nodes = TypedDict('_Nodes', {'nodes': list[Optional[_PullRequest]]}, total=False)
+_NodesResponse = TypedDict('_NodesResponse', {'data': _Nodes})
 
 
 class _Request(TypedDict, total=False):
@@ -191,9 +213,16 @@ def _get_user(github_handle: str, config: _Config, as_channel: bool = False) ->
     return f'@{user_id}' if as_channel else f'<@{user_id}>'
 
 
+# Maximum number of Slack messages being sent at the same time.
+_MAX_SLACK_WORKERS = 8
+
+
 # TODO(cyrille): Consider using a repo-specific channel.
 def _post_to_slack(prepared_request: _Request, config: _Config) -> None:
-    response = requests.post(config.slack_url, json=prepared_request)
+    import http_client  # pylint: disable=import-outside-toplevel
+
+    response = http_client.get_session(config.slack_url).post(
+        config.slack_url, json=prepared_request)
     response.raise_for_status()
 
 
@@ -217,18 +246,16 @@ def _send_review(
     _post_to_slack(request, config)
 
 
-def _get_more_info(pull_request: _GithubPullRequest, config: _Config) -> _ReviewInfo:
-    """Whether the given commit needs a review, and if so on what demo."""
+def _post_graphql(query: str, variables: dict[str, Any], config: _Config) -> Any:
+    import http_client  # pylint: disable=import-outside-toplevel
 
-    response = requests.post('https://api.github.com/graphql', json={
-        'query': _PULL_REQUEST_INFO_GRAPHQL_QUERY,
-        'variables': {
-            'prNodeId': pull_request['node_id'],
-        },
-    }, headers={'Authorization': f'token {config.github_token}'})
+    response = http_client.github_session(config.github_token).post(
+        'https://api.github.com/graphql', json={'query': query, 'variables': variables})
     response.raise_for_status()
-    graphql_response: _Response = response.json()
-    pr_data = graphql_response.get('data', {}).get('node')
+    return response.json()
+
+
+def _parse_review_info(pr_data: Optional[_PullRequest]) -> _ReviewInfo:
     if not pr_data:
         # Unable to fetch PR data somehow, let's assume it needs reviewing.
         return _ReviewInfo(True)
@@ -247,28 +274,66 @@ def _get_more_info(pull_request: _GithubPullRequest, config: _Config) -> _Review
     return _ReviewInfo(True, demo_url)
 
 
-def ping_request_reviewers(
-        pull_request: _GithubPullRequest, demos: list[tuple[str, str]], config: _Config, *,
-        before: Optional[datetime.datetime] = None, should_get_more_info: bool = True) -> int:
-    """Ping reviewers for a given PR."""
+def _get_more_info(pull_request: _GithubPullRequest, config: _Config) -> _ReviewInfo:
+    """Whether the given commit needs a review, and if so on what demo."""
+
+    graphql_response: _Response = _post_graphql(
+        _PULL_REQUEST_INFO_GRAPHQL_QUERY, {'prNodeId': pull_request['node_id']}, config)
+    return _parse_review_info(graphql_response.get('data', {}).get('node'))
+
+
+def _get_more_info_for_all(pull_requests: Sequence[_GithubPullRequest], config: _Config) \
+        -> list[_ReviewInfo]:
+    """Same as _get_more_info, for several PRs, batching the GraphQL queries."""
+
+    review_infos: list[_ReviewInfo] = []
+    for start in range(0, len(pull_requests), _GRAPHQL_BATCH_SIZE):
+        batch = pull_requests[start:start + _GRAPHQL_BATCH_SIZE]
+        graphql_response: _NodesResponse = _post_graphql(
+            _PULL_REQUESTS_INFO_GRAPHQL_QUERY,
+            {'prNodeIds': [pull_request['node_id'] for pull_request in batch]}, config)
+        nodes = graphql_response.get('data', {}).get('nodes') or []
+        review_infos.extend(
+            _parse_review_info(nodes[index] if index < len(nodes) else None)
+            for index in range(len(batch)))
+    return review_infos
+
+
+def _get_reviewers(
+        pull_request: _GithubPullRequest, before: Optional[datetime.datetime] = None) -> list[str]:
+    """List the reviewers that could be pinged for the given PR."""
 
     if before and before < datetime.datetime.fromisoformat(
             pull_request['created_at'].removesuffix('Z')):
-        return 0
+        return []
     if pull_request.get('user', {}).get('login', '').endswith('[bot]'):
         # Not pinging for bot reviews.
-        return 0
-    all_reviewers = list(filter(None, {
+        return []
+    return list(filter(None, {
         reviewer.get('login', '')
         for reviewer_list in (
             pull_request.get('requested_reviewers', []),
             pull_request.get('assignees', []))
         for reviewer in reviewer_list}))
+
+
+def ping_request_reviewers(
+        pull_request: _GithubPullRequest, demos: list[tuple[str, str]], config: _Config, *,
+        before: Optional[datetime.datetime] = None, should_get_more_info: bool = True,
+        review_info: Optional[_ReviewInfo] = None) -> int:
+    """Ping reviewers for a given PR.
+
+    If review_info is given, it is used instead of fetching more info about the PR.
+    """
+
+    all_reviewers = _get_reviewers(pull_request, before)
     if not all_reviewers:
         return 0
-    if should_get_more_info:
+    if review_info is None and should_get_more_info:
+        review_info = _get_more_info(pull_request, config)
+    if review_info:
         # Make sure we actually want a review.
-        should_review, real_demo_url = _get_more_info(pull_request, config)
+        should_review, real_demo_url = review_info
         if not should_review:
             return 0
         if not demos and real_demo_url:
@@ -278,14 +343,27 @@ def ping_request_reviewers(
         'Pinging reviewers (of #%s) on Slack to tell them the Demo is ready…', pr_number)
     title = pull_request['title']
     author = pull_request['user']['login']
+    import requests  # pylint: disable=import-outside-toplevel
+
     ping_count = 0
-    try:
-        for reviewer in all_reviewers:
-            # TODO(cyrille): Only ping the reviewers who haven't LGTM.
-            # TODO(cyrille): Ping the author if there are no reviewers without LGTM.
-            _send_review(pr_number, title, author, demos, config, github_reviewer=reviewer)
-            ping_count += 1
-    except (requests.HTTPError, KeyError):
+    has_failed = False
+    with futures.ThreadPoolExecutor(max_workers=_MAX_SLACK_WORKERS) as executor:
+        # TODO(cyrille): Only ping the reviewers who haven't LGTM.
+        # TODO(cyrille): Ping the author if there are no reviewers without LGTM.
+        pings = [
+            executor.submit(
+                _send_review, pr_number, title, author, demos, config, github_reviewer=reviewer)
+            for reviewer in sorted(all_reviewers)]
+        # Only the pings before the first failure are counted, as when they were sent in turn.
+        for ping in pings:
+            try:
+                ping.result()
+            except (requests.HTTPError, KeyError):
+                has_failed = True
+                continue
+            if not has_failed:
+                ping_count += 1
+    if has_failed:
         logging.warning('Pinging on default channel')
         # Unable to send the review to one of the reviewers, sending it to default channel.
         named_reviewers = ', '.join(_get_user(r, config) for r in sorted(all_reviewers))
@@ -306,26 +384,50 @@ def ping_for_release(demo_url: str, callback_url: str, config: _Config) -> int:
     return 1
 
 
+def _get_from_github(url: str, config: _Config, **kwargs: Any) -> 'requests.Response':
+    import http_client  # pylint: disable=import-outside-toplevel
+
+    response = http_client.github_session(config.github_token).get(url, **kwargs)
+    response.raise_for_status()
+    return response
+
+
 def _get_pr_api_url(config: _Config, should_ping_stale: bool) -> Optional[str]:
     if should_ping_stale:
-        return f'https://api.github.com/repos/{config.github_repo}/pulls?direction=asc'
+        return f'https://api.github.com/repos/{config.github_repo}/pulls' \
+            '?direction=asc&per_page=100'
     if not config.pr_number and not config.commit:
         return None
     pr_number = config.pr_number
     if not pr_number:
         # TODO(cyrille): Replace config.commit by CIRCLE_BRANCH, and use /pulls?head=branch instead.
-        response = requests.get(
-            'https://api.github.com/search/issues', params=dict(q=config.commit), headers={
-                'Accept': 'application/vnd.github.v3+json',
-                'Authorization': f'token {config.github_token}',
-            })
-        response.raise_for_status()
+        response = _get_from_github(
+            'https://api.github.com/search/issues', config, params=dict(q=config.commit))
         pr_number = str(response.json().get('number', ''))
     if not pr_number:
         return None
     return f'https://api.github.com/repos/{config.github_repo}/pulls/{pr_number}'
 
 
+def _iterate_pull_requests(
+        url: str, config: _Config, *, before: datetime.datetime) -> Iterator[_GithubPullRequest]:
+    """Iterate lazily on all pages of a PR listing sorted by ascending creation date.
+
+    Stops as soon as a PR was created after the given date.
+    """
+
+    next_url: Optional[str] = url
+    while next_url:
+        response = _get_from_github(next_url, config)
+        pull_request: _GithubPullRequest
+        for pull_request in response.json():
+            if before < datetime.datetime.fromisoformat(
+                    pull_request['created_at'].removesuffix('Z')):
+                return
+            yield pull_request
+        next_url = response.links.get('next', {}).get('url')
+
+
 def ping_reviewers(demos: list[tuple[str, str]], ping_stale_reviews: bool, config: _Config) \
         -> int:
     """Send slack pings to the relevant people, if requirements are met."""
@@ -342,20 +444,20 @@ def ping_reviewers(demos: list[tuple[str, str]], ping_stale_reviews: bool, confi
     if not query:
         logging.info('No PR to review, please set CIRCLE_PULL_REQUEST with a Github PR url.')
         return 0
-    response = requests.get(query, headers={
-        'Accept': 'application/vnd.github.v3+json',
-        'Authorization': f'token {config.github_token}',
-    })
-    response.raise_for_status()
-    pull_requests = response.json()
     if not ping_stale_reviews:
         # Response to the /pulls/PR_NUMBER endpoint only has 1 PR in its answer.
-        pull_requests = [pull_requests]
+        return ping_request_reviewers(_get_from_github(query, config).json(), demos, config)
     yesterday = datetime.datetime.now() - datetime.timedelta(days=1)
+    # Only fetch more info for the PRs that may actually be pinged.
+    candidates = (
+        pull_request
+        for pull_request in _iterate_pull_requests(query, config, before=yesterday)
+        if _get_reviewers(pull_request, yesterday))
     ping_count = 0
-    for pull_request in pull_requests:
-        ping_count += ping_request_reviewers(
-            pull_request, demos, config, before=yesterday if ping_stale_reviews else None)
+    while batch := list(itertools.islice(candidates, _GRAPHQL_BATCH_SIZE)):
+        for pull_request, review_info in zip(batch, _get_more_info_for_all(batch, config)):
+            ping_count += ping_request_reviewers(
+                pull_request, demos, config, before=yesterday, review_info=review_info)
     return ping_count
 
 
@@ -398,5 +500,7 @@ def main(string_args: Optional[Sequence[str]] = None, env: Optional[dict[str, st
 
 
 if __name__ == '__main__':
+    import ci_daemon
+    ci_daemon.forward_to_daemon(__file__)
     logging.basicConfig(level=logging.INFO)
     main()
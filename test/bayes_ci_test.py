@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""Tests for the bayes-ci entry point."""
+
+import os
+from os import path
+import subprocess
+import sys
+import unittest
+
+_BIN_PATH = f'{path.dirname(path.dirname(path.abspath(__file__)))}/bin'
+_BAYES_CI_PATH = f'{_BIN_PATH}/bayes-ci'
+# Cold start budget of a command, on top of starting Python itself. Commands import at most 86
+# extra modules with Python 3.9 to 3.13, while requests alone imports about 140 of them.
+_MAX_EXTRA_IMPORTED_MODULES = 100
+
+
+def _get_imported_modules(*command: str, env: dict[str, str]) -> set[str]:
+    """Run a command with -X importtime, and get the modules it imports."""
+
+    stderr = subprocess.run(
+        [sys.executable, '-X', 'importtime'] + list(command),
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True).stderr
+    return {
+        line.rsplit('|', 1)[1].strip()
+        for line in stderr.split('\n')
+        if line.startswith('import time:') and 'self [us]' not in line}
+
+
+class BayesCiTestCase(unittest.TestCase):
+    """Tests for the bayes-ci entry point."""
+
+    _env = {
+        name: value for name, value in os.environ.items()
+        if not name.startswith(('CIRCLE_', 'SLACK_', 'GITHUB_'))}
+
+    def test_dispatch(self) -> None:
+        """Run the script of the given command, with the remaining arguments."""
+
+        output = subprocess.check_output(
+            [_BAYES_CI_PATH, 'get-demo-vars', '--format=env', 'ci_callback_url'],
+            env=self._env | {'CIRCLE_TAG': 'release'}, text=True)
+        self.assertEqual('', output.strip())
+
+        output = subprocess.check_output(
+            [_BAYES_CI_PATH, 'get-demo-vars', '--format=env', 'repo'],
+            env=self._env | {
+                'CIRCLE_BRANCH': 'branch',
+                'CIRCLE_PROJECT_REPONAME': 'bob',
+                'CIRCLE_PROJECT_USERNAME': 'bayes',
+                'CIRCLE_TAG': '',
+            }, text=True)
+        self.assertEqual('DEMO_REPO=bayes/bob', output.strip())
+
+    def test_unknown_command(self) -> None:
+        """Fail on unknown commands."""
+
+        with self.assertRaises(subprocess.CalledProcessError):
+            subprocess.check_output(
+                [_BAYES_CI_PATH, 'unknown-command'], env=self._env, stderr=subprocess.DEVNULL)
+
+    def test_cold_start(self) -> None:
+        """Commands exiting early do not import requests, nor many other modules."""
+
+        python_modules = _get_imported_modules('-c', 'pass', env=self._env)
+        for command in (
+                ('ping-reviewers',),
+                ('get-demo-vars', 'repo'),
+                ('check-recent-todos', '--help'),
+        ):
+            imported_modules = _get_imported_modules(
+                _BAYES_CI_PATH, *command, env=self._env | {'CIRCLE_TAG': 'release'})
+            self.assertNotIn('requests', imported_modules, msg=command)
+            self.assertNotIn('http_client', imported_modules, msg=command)
+            extra_modules = imported_modules - python_modules
+            self.assertLessEqual(
+                len(extra_modules), _MAX_EXTRA_IMPORTED_MODULES, msg=sorted(extra_modules))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""Tests for the check_fresh_release script."""
+
+import contextlib
+import datetime
+from importlib import abc
+from importlib import util
+import io
+import json
+import os
+from os import path
+import sys
+import typing
+import unittest
+
+import git_repo
+
+if typing.TYPE_CHECKING:
+    from bin import check_fresh_release
+else:
+    _BIN_PATH = f'{path.dirname(path.dirname(path.abspath(__file__)))}/bin'
+    sys.path.insert(0, _BIN_PATH)
+    _SCRIPT_PATH = f'{_BIN_PATH}/check_fresh_release.py'
+    _SCRIPT_SPEC = util.spec_from_file_location('check_fresh_release', _SCRIPT_PATH)
+    assert _SCRIPT_SPEC
+    check_fresh_release = util.module_from_spec(_SCRIPT_SPEC)
+    typing.cast(abc.Loader, _SCRIPT_SPEC.loader).exec_module(check_fresh_release)
+
+# A commit time, in seconds since epoch.
+_T0 = 1_600_000_000
+
+
+class DurationTestCase(unittest.TestCase):
+    """Tests for the durations, as understood by `date`."""
+
+    _start = datetime.datetime(2021, 1, 31, 12)
+
+    def test_add(self) -> None:
+        """Add several units to a date."""
+
+        self.assertEqual(
+            datetime.datetime(2021, 2, 14, 12), check_fresh_release._add_duration(
+                self._start, '14 days'))
+        self.assertEqual(
+            datetime.datetime(2021, 2, 15, 13), check_fresh_release._add_duration(
+                self._start, '2 weeks 1day 1 hour'))
+        # February 31st is March 3rd.
+        self.assertEqual(
+            datetime.datetime(2021, 3, 3, 12), check_fresh_release._add_duration(
+                self._start, '1 month'))
+        self.assertEqual(
+            datetime.datetime(2022, 1, 31, 12), check_fresh_release._add_duration(
+                self._start, 'year'))
+
+    def test_invalid(self) -> None:
+        """Refuse unknown units."""
+
+        with self.assertRaises(ValueError):
+            check_fresh_release._add_duration(self._start, '3 sprints')
+
+
+class CheckFreshReleaseTestCase(git_repo.GitRepoTestCase):
+    """Tests for checking the releases in a git repository."""
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        cls._commit(_T0, 'frontend/a.js', 'Initial commit.')
+        cls._commit(_T0, 'shared/c.txt', 'Add a shared file.')
+        git_repo.run_git('update-ref', 'refs/remotes/origin/prod', 'HEAD')
+        git_repo.run_git('update-ref', 'refs/remotes/origin/prod-backend', 'HEAD')
+        cls._commit(_T0 + 1000, 'backend/b.py', 'Change the backend.')
+        git_repo.run_git('update-ref', 'refs/remotes/origin/prod', 'HEAD')
+        cls._commit(_T0 + 2000, 'frontend/a.js', 'Change the frontend.')
+        cls._commit(_T0 + 3000, 'backend/b.py', 'Change the backend again.')
+        os.rename('shared', 'archive')
+        git_repo.commit('Archive the shared file.', _T0 + 4000)
+        git_repo.run_git('update-ref', 'refs/remotes/origin/main', 'HEAD')
+        git_repo.run_git('symbolic-ref', 'refs/remotes/origin/HEAD', 'refs/remotes/origin/main')
+
+    @classmethod
+    def _commit(cls, timestamp: int, name: str, message: str) -> None:
+        os.makedirs(path.dirname(name), exist_ok=True)
+        with open(name, 'a') as file:
+            file.write(f'{message}\n')
+        git_repo.commit(message, timestamp)
+
+    def _main(self, *args: str) -> tuple[typing.Any, str]:
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            try:
+                check_fresh_release.main(args)
+            except SystemExit as error:
+                return error.code, output.getvalue()
+        return 0, output.getvalue()
+
+    def test_stale(self) -> None:
+        """List the unreleased commits, and fail."""
+
+        exit_code, output = self._main('origin/prod', '14 days', 'frontend')
+        self.assertEqual(1, exit_code)
+        lines = output.splitlines()
+        self.assertEqual(
+            'There is some unreleased code on origin/main since 2020-09-13 13:00:00 +0000',
+            lines[0])
+        self.assertEqual(2, len(lines))
+        self.assertTrue(lines[1].endswith('TEST: Change the frontend.'), msg=lines[1])
+
+    def test_fresh(self) -> None:
+        """Accept unreleased commits, if they are recent enough."""
+
+        exit_code, output = self._main('origin/prod', '100 years')
+        self.assertEqual(0, exit_code)
+        self.assertEqual(
+            'The oldest commit on origin/main after origin/prod is less than 100 years old:\n'
+            '2020-09-13 13:00:00 +0000\n', output)
+
+    def test_released(self) -> None:
+        """Accept a folder without any unreleased commits."""
+
+        exit_code, output = self._main('origin/main', '14 days', 'frontend')
+        self.assertEqual(0, exit_code)
+        self.assertEqual('No commits on origin/main since origin/main.\n', output)
+
+    def test_invalid_duration(self) -> None:
+        """Fail on durations that `date` would not understand."""
+
+        exit_code, unused_output = self._main('origin/prod', 'a fortnight or so')
+        self.assertEqual('Invalid duration: "a fortnight or so", unknown unit "a".', exit_code)
+
+    def test_json(self) -> None:
+        """Check several projects at once."""
+
+        exit_code, output = self._main(
+            '--json', 'origin/prod', '100 years', '--project', 'frontend:origin/prod',
+            '--project', 'backend:origin/prod-backend', '--project', 'backend:origin/prod')
+        self.assertEqual(0, exit_code)
+        report = json.loads(output)
+        self.assertEqual('origin/main', report['defaultBranch'])
+        self.assertEqual(
+            [('frontend', 1), ('backend', 2), ('backend', 1)],
+            [(project['folder'], project['unreleasedCommitsCount'])
+             for project in report['projects']])
+        self.assertEqual('2020-09-13T12:43:20+00:00', report['projects'][1]['unreleasedSince'])
+
+    def test_json_released(self) -> None:
+        """Give the same keys for projects without any unreleased commits."""
+
+        exit_code, output = self._main(
+            '--json', 'origin/main', '100 years', '--project', 'frontend:origin/prod',
+            '--project', 'frontend:origin/main')
+        self.assertEqual(0, exit_code)
+        stale, released = json.loads(output)['projects']
+        self.assertEqual(sorted(stale), sorted(released))
+        self.assertIsNone(released['oldestUnreleasedCommit'])
+        self.assertIsNone(released['unreleasedSince'])
+        self.assertEqual(0, released['unreleasedCommitsCount'])
+
+    def test_moved_file(self) -> None:
+        """Consider a file moved from a folder to another as a change in both."""
+
+        exit_code, output = self._main(
+            '--json', 'origin/prod', '100 years', '--project', 'shared:origin/prod',
+            '--project', 'archive:origin/prod')
+        self.assertEqual(0, exit_code)
+        self.assertEqual(
+            [('shared', 1), ('archive', 1)],
+            [(project['folder'], project['unreleasedCommitsCount'])
+             for project in json.loads(output)['projects']])
+
+
+if __name__ == '__main__':
+    unittest.main()
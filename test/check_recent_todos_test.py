@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""Tests for the check_recent_todos script."""
+
+from importlib import abc
+from importlib import util
+import io
+import json
+import os
+from os import path
+import sys
+import typing
+import unittest
+from unittest import mock
+
+import git_repo
+
+if typing.TYPE_CHECKING:
+    from bin import check_recent_todos
+else:
+    _BIN_PATH = f'{path.dirname(path.dirname(path.abspath(__file__)))}/bin'
+    sys.path.insert(0, _BIN_PATH)
+    _SCRIPT_PATH = f'{_BIN_PATH}/check_recent_todos.py'
+    _SCRIPT_SPEC = util.spec_from_file_location('check_recent_todos', _SCRIPT_PATH)
+    assert _SCRIPT_SPEC
+    check_recent_todos = util.module_from_spec(_SCRIPT_SPEC)
+    # Make the module reachable from the processes scanning files.
+    sys.modules[_SCRIPT_SPEC.name] = check_recent_todos
+    typing.cast(abc.Loader, _SCRIPT_SPEC.loader).exec_module(check_recent_todos)
+
+_TodoRef = check_recent_todos._TodoRef
+# A commit time, in seconds since epoch.
+_T0 = 1_600_000_000
+
+
+def _write_file(name: str, content: str) -> None:
+    os.makedirs(path.dirname(name) or '.', exist_ok=True)
+    with open(name, 'w') as file:
+        file.write(content)
+
+
+class DiffTodosTestCase(unittest.TestCase):
+    """Tests for the TODO diff."""
+
+    def test_moved(self) -> None:
+        """A TODO moving within a file is not a change."""
+
+        new_todos, closed_count = check_recent_todos._diff_todos(
+            [_TodoRef('a.py', 12, 'Fix this.', 'bob'), _TodoRef('b.py', 3, 'Do that.')],
+            [_TodoRef('a.py', 10, 'Fix this.', 'bob'), _TodoRef('c.py', 3, 'Do that.')])
+        self.assertEqual([_TodoRef('b.py', 3, 'Do that.')], new_todos)
+        self.assertEqual(1, closed_count)
+
+    def test_duplicates(self) -> None:
+        """Identical TODOs in a file are counted."""
+
+        new_todos, closed_count = check_recent_todos._diff_todos(
+            [_TodoRef('a.py', 1, 'Same.'), _TodoRef('a.py', 2, 'Same.')],
+            [_TodoRef('a.py', 1, 'Same.'), _TodoRef('b.py', 1, 'Same.'),
+             _TodoRef('b.py', 2, 'Same.')])
+        self.assertEqual([_TodoRef('a.py', 2, 'Same.')], new_todos)
+        self.assertEqual(2, closed_count)
+
+    def test_linear_comparisons(self) -> None:
+        """The diff compares each TODO with only a few others."""
+
+        comparisons = 0
+
+        class _CountingTodoRef(_TodoRef):
+
+            def __eq__(self, other: typing.Any) -> bool:
+                nonlocal comparisons
+                comparisons += 1
+                return super().__eq__(other)
+
+            __hash__ = _TodoRef.__hash__
+
+        for size in (10_000, 50_000, 100_000):
+            # Each TODO is duplicated in its file, and a tenth of them change between the lists.
+            recent_todos: list[_TodoRef] = [
+                _CountingTodoRef(f'file{index % 1000}.py', index, f'Recent TODO {index // 2000}.')
+                for index in range(size)]
+            old_todos: list[_TodoRef] = [
+                _CountingTodoRef(f'file{index % 1000}.py', index, f'Recent TODO {index // 2000}.')
+                if index % 10 else
+                _CountingTodoRef(f'file{index % 1000}.py', index, f'Old TODO {index}.')
+                for index in range(size)]
+            comparisons = 0
+            new_todos, closed_count = check_recent_todos._diff_todos(recent_todos, old_todos)
+            with self.subTest(size=size):
+                self.assertEqual(size // 10, len(new_todos))
+                self.assertEqual(size // 10, closed_count)
+                # A quadratic diff would make about size² / 2 comparisons.
+                self.assertLessEqual(comparisons, 4 * size)
+
+
+class ChangedTodosTestCase(git_repo.GitRepoTestCase):
+    """Tests for the diff engine, cross-checked with the full scan."""
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        _write_file('a.py', '# TODO(bob): Moved.\n# TODO: Removed.\n# Not a todo.\n')
+        _write_file('sub/b.py', 'print(1)  # TODO: Renamed.\n')
+        _write_file('sub/c.py', '# TODO: Same.\n')
+        git_repo.commit('First commit.')
+        _write_file('a.py', '# Not a todo.\n# TODO(bob): Moved.\n# TODO(alice): Added.\n')
+        os.rename('sub/b.py', 'sub/d.py')
+        _write_file('sub/c.py', '# TODO: Same.\n# TODO: Same.\n')
+        with open('binary', 'wb') as file:
+            file.write(b'\x00TODO: Binary.\n')
+        git_repo.commit('Second commit.')
+
+    def _full_scan_diff(self, folder: str) -> tuple[list[_TodoRef], int]:
+        return check_recent_todos._diff_todos(
+            list(check_recent_todos._scan_all_todos(folder)),
+            list(check_recent_todos._parse_all_todos(
+                check_recent_todos._git_grep_all_todos('HEAD~', folder))))
+
+    def test_diff(self) -> None:
+        """Only parse added and removed lines."""
+
+        new_todos, closed_count = check_recent_todos._diff_todos(
+            *check_recent_todos._get_changed_todos('HEAD~', '.'))
+        self.assertEqual([
+            _TodoRef('a.py', 3, 'Added.', 'alice'),
+            _TodoRef('sub/c.py', 2, 'Same.'),
+            _TodoRef('sub/d.py', 1, 'Renamed.'),
+        ], sorted(new_todos))
+        self.assertEqual([3, 2, 1], [todo.line for todo in sorted(new_todos)])
+        self.assertEqual(2, closed_count)
+
+    def test_cross_check(self) -> None:
+        """The diff engine gives the same results as the full scan."""
+
+        for folder in ('.', 'sub'):
+            new_todos, closed_count = check_recent_todos._diff_todos(
+                *check_recent_todos._get_changed_todos('HEAD~', folder))
+            full_new_todos, full_closed_count = self._full_scan_diff(folder)
+            self.assertEqual(sorted(full_new_todos), sorted(new_todos), msg=folder)
+            self.assertEqual(
+                [todo.line for todo in sorted(full_new_todos)],
+                [todo.line for todo in sorted(new_todos)], msg=folder)
+            self.assertEqual(full_closed_count, closed_count, msg=folder)
+
+    def test_index(self) -> None:
+        """The TODO index gives the same results as git grep, and only parses blobs once."""
+
+        index_path = path.join(self.repo_dir, 'index.db')
+        self.addCleanup(os.remove, index_path)
+        index = check_recent_todos._TodoIndex(index_path)
+        for revision, folder in (('HEAD~', '.'), ('HEAD', '.'), ('HEAD', 'sub')):
+            self.assertEqual(
+                sorted(check_recent_todos._parse_all_todos(
+                    check_recent_todos._git_grep_all_todos(revision, folder))),
+                sorted(index.get_revision_todos(revision, folder)), msg=(revision, folder))
+        parsed_count = index.parsed_blobs_count
+        self.assertTrue(parsed_count)
+        index.close()
+
+        index = check_recent_todos._TodoIndex(index_path)
+        todos = list(index.get_revision_todos('HEAD', '.'))
+        index.close()
+        self.assertEqual(5, len(todos))
+        self.assertEqual(0, index.parsed_blobs_count)
+        self.assertEqual(4, index.cached_blobs_count)
+
+    @mock.patch('sys.stderr', new_callable=io.StringIO)
+    def test_stats_without_index(self, mock_stderr: io.StringIO) -> None:
+        """Refuse to report stats when there is no index."""
+
+        with self.assertRaises(SystemExit):
+            check_recent_todos.main(['--stats'])
+        self.assertIn('--stats is only available with --index-cache.', mock_stderr.getvalue())
+
+
+class SeriesTestCase(git_repo.GitRepoTestCase):
+    """Tests for the TODO counts series."""
+
+    @classmethod
+    def _commit(cls, timestamp: int, files: dict[str, str]) -> None:
+        for name, content in files.items():
+            _write_file(name, content)
+        git_repo.commit(f'Commit at {timestamp}.', timestamp)
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        cls._commit(_T0 + 1000, {'a.py': '# TODO(bob): First.\n', 'sub/b.py': '# TODO: Second.\n'})
+        cls._commit(_T0 + 2000, {'a.py': '# TODO(bob): First.\n# TODO(alice): Third.\n'})
+        cls._commit(_T0 + 3000, {'sub/b.py': '-- TODO: SQL comment.\n-- Not a todo.\n'})
+        cls._commit(_T0 + 4000, {'a.py': '# Done.\n# TODO(alice): Third.\n'})
+
+    def test_series(self) -> None:
+        """Count TODOs by owner at each point in time, as git grep would."""
+
+        base_revision = git_repo.run_git('rev-list', '--reverse', 'HEAD').split('\n')[0]
+        base_counts = check_recent_todos._count_todos_by_owner(check_recent_todos._parse_all_todos(
+            check_recent_todos._git_grep_all_todos(base_revision, '.')))
+        timestamps = [_T0 + 1500, _T0 + 2500, _T0 + 3000, _T0 + 3500, _T0 + 4500]
+        series = check_recent_todos._get_todo_series(base_revision, '.', timestamps, base_counts)
+        self.assertEqual(timestamps, [point.timestamp for point in series])
+        commits = git_repo.run_git('log', '--format=%H %ct').split('\n')
+        for point in series:
+            revision = next(
+                sha for sha, timestamp in (commit.split(' ') for commit in commits)
+                if int(timestamp) <= point.timestamp)
+            expected_counts = check_recent_todos._count_todos_by_owner(
+                check_recent_todos._parse_all_todos(
+                    check_recent_todos._git_grep_all_todos(revision, '.')))
+            self.assertEqual(
+                {owner: count for owner, count in expected_counts.items() if count},
+                {owner: count for owner, count in point.counts.items() if count},
+                msg=point.timestamp)
+
+    def test_format(self) -> None:
+        """Format the series as CSV or JSON."""
+
+        series = check_recent_todos._get_todo_series('', 'sub', [_T0, _T0 + 2000, _T0 + 86400], {})
+        self.assertEqual(
+            '''date,total,(none)
+2020-09-13,0,0
+2020-09-13,1,1
+2020-09-14,1,1''',
+            check_recent_todos._format_series(series, 'csv'))
+        self.assertEqual(
+            [{'date': '2020-09-14', 'owners': {'(none)': 1}, 'total': 1}],
+            json.loads(check_recent_todos._format_series(series[2:], 'json')))
+
+    @mock.patch('sys.stderr', new_callable=io.StringIO)
+    def test_invalid_interval(self, mock_stderr: io.StringIO) -> None:
+        """Refuse a series without any interval."""
+
+        with self.assertRaises(SystemExit):
+            check_recent_todos.main(['--series', 'csv', '--series-interval', '0'])
+        self.assertIn('0 is not a positive integer.', mock_stderr.getvalue())
+
+    @mock.patch('sys.stderr', new_callable=io.StringIO)
+    def test_full_scan(self, mock_stderr: io.StringIO) -> None:
+        """Refuse the full scan, which the series would ignore."""
+
+        with self.assertRaises(SystemExit):
+            check_recent_todos.main(['--series', 'csv', '--full-scan'])
+        self.assertIn('--full-scan is not available with --series.', mock_stderr.getvalue())
+
+    @mock.patch('sys.stderr', new_callable=io.StringIO)
+    def test_index_cache(self, mock_stderr: io.StringIO) -> None:
+        """Count the TODOs of the base revision with the index, as with git grep."""
+
+        index_path = path.join(self.repo_dir, 'index.db')
+        self.addCleanup(os.remove, index_path)
+        with mock.patch('sys.stdout', new_callable=io.StringIO) as mock_stdout:
+            check_recent_todos.main(['--series', 'csv'])
+        series = mock_stdout.getvalue()
+        self.assertIn('(none),alice', series.split('\n')[0])
+
+        with mock.patch('sys.stdout', new_callable=io.StringIO) as mock_stdout:
+            check_recent_todos.main(['--series', 'csv', '--index-cache', index_path, '--stats'])
+        self.assertEqual(series, mock_stdout.getvalue())
+        self.assertIn('TODO index: 0 blobs from cache, 2 blobs parsed.', mock_stderr.getvalue())
+
+
+class ScanTodosTestCase(git_repo.GitRepoTestCase):
+    """Tests for the native TODO scanner."""
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        _write_file('.gitignore', 'ignored/\n')
+        _write_file('a.py', 'x = 1\n# TODO(bob): First. TODO: Same line.\r\n\n# NOTODO\n')
+        _write_file('sub/b.py', '# TODO: No final new line.')
+        _write_file('sub/empty.py', '')
+        _write_file('ignored/c.py', '# TODO: Ignored.\n')
+        with open('binary', 'wb') as file:
+            file.write(b'\x00TODO: Binary.\n')
+        os.symlink('a.py', 'link.py')
+        git_repo.run_git('add', '.')
+        _write_file('untracked.py', '# TODO: Untracked.\n')
+
+    def test_scan(self) -> None:
+        """Find TODOs in text files tracked by git, as git grep does in old revisions."""
+
+        self.assertEqual([
+            _TodoRef('a.py', 2, 'First. TODO: Same line.', 'bob'),
+            _TodoRef('sub/b.py', 1, 'No final new line.'),
+        ], sorted(check_recent_todos._scan_all_todos('.', jobs=1)))
+        self.assertEqual(
+            [_TodoRef('sub/b.py', 1, 'No final new line.')],
+            list(check_recent_todos._scan_all_todos('sub', jobs=1)))
+
+    def test_mmap(self) -> None:
+        """Scanning files mapped in memory gives the same results."""
+
+        todos = sorted(check_recent_todos._scan_all_todos('.', jobs=1))
+        with mock.patch.object(check_recent_todos, '_MMAP_MIN_SIZE', 1):
+            self.assertEqual(todos, sorted(check_recent_todos._scan_all_todos('.', jobs=1)))
+
+    @mock.patch.object(check_recent_todos, '_SCAN_CHUNK_SIZE', 1)
+    def test_parallel_scan(self) -> None:
+        """Scanning in several processes gives the same results."""
+
+        self.assertEqual(
+            sorted(check_recent_todos._scan_all_todos('.', jobs=1)),
+            sorted(check_recent_todos._scan_all_todos('.', jobs=2)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""Tests for the ci_daemon module."""
+
+import os
+from os import path
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import typing
+import unittest
+from unittest import mock
+
+_BIN_PATH = f'{path.dirname(path.dirname(path.abspath(__file__)))}/bin'
+if typing.TYPE_CHECKING:
+    from bin import ci_daemon
+else:
+    sys.path.insert(0, _BIN_PATH)
+    import ci_daemon
+
+_GET_DEMO_VARS_PATH = f'{_BIN_PATH}/get_demo_vars.py'
+# A script showing where it runs, with output from a subprocess.
+_SCRIPT = f'''
+import logging
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, {_BIN_PATH!r})
+import ci_daemon
+ci_daemon.forward_to_daemon(__file__)
+
+logging.basicConfig(level=logging.INFO)
+print(os.getpid(), os.getenv('MY_VAR'), flush=True)
+subprocess.run(['sh', '-c', 'echo "Error from a subprocess." >&2'], check=True)
+if len(sys.argv) > 2:
+    # Wait for the test to let the command end.
+    while not os.path.exists(sys.argv[2]):
+        time.sleep(.01)
+    import http_client
+    http_client._GITHUB_SCHEDULER.calls += 1
+sys.exit(int(sys.argv[1]))
+'''
+
+
+class DaemonTestCase(unittest.TestCase):
+    """Tests for running scripts in the daemon."""
+
+    def setUp(self) -> None:
+        super().setUp()
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        self._socket_path = path.join(folder, 'daemon.sock')
+        self._script_path = path.join(folder, 'script.py')
+        with open(self._script_path, 'w') as file:
+            file.write(_SCRIPT)
+
+    def _start_daemon(self) -> int:
+        daemon = subprocess.Popen([
+            sys.executable, f'{_BIN_PATH}/ci_daemon.py', '--socket', self._socket_path,
+            '--idle-seconds', '30',
+        ])
+        self.addCleanup(daemon.wait)
+        self.addCleanup(daemon.terminate)
+        for unused_ in range(100):
+            if path.exists(self._socket_path):
+                return daemon.pid
+            time.sleep(.1)
+        self.fail('The daemon did not start.')
+
+    def _start_script(self, *argv: str, my_var: str = '') -> 'subprocess.Popen[str]':
+        return subprocess.Popen(
+            [sys.executable, self._script_path] + list(argv),
+            env=dict(os.environ) | {
+                'BAYES_CI_DAEMON': '1',
+                'BAYES_CI_SOCKET': self._socket_path,
+                'MY_VAR': my_var,
+            },
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+
+    def test_forward(self) -> None:
+        """Run the script in the daemon, with the client's environment and streams."""
+
+        daemon_pid = self._start_daemon()
+        for exit_code, my_var in ((0, 'first'), (3, 'second')):
+            script = self._start_script(str(exit_code), my_var=my_var)
+            stdout, stderr = script.communicate(timeout=10)
+            self.assertEqual(exit_code, script.returncode)
+            self.assertEqual(f'{daemon_pid} {my_var}\n', stdout)
+            self.assertEqual('Error from a subprocess.\n', stderr)
+
+    def test_summary(self) -> None:
+        """Log the summaries at the end of each command."""
+
+        self._start_daemon()
+        for unused_ in range(2):
+            script = self._start_script('0', self._script_path)
+            unused_stdout, stderr = script.communicate(timeout=10)
+            self.assertEqual(1, stderr.count('Github API: 1 calls made'), msg=stderr)
+
+    def test_busy(self) -> None:
+        """Run the script in-process when the daemon is busy."""
+
+        daemon_pid = self._start_daemon()
+        release_path = f'{self._script_path}.release'
+        slow_script = self._start_script('0', release_path)
+        # Let the daemon start the slow command.
+        assert slow_script.stdout
+        self.assertEqual(str(daemon_pid), slow_script.stdout.readline().split()[0])
+        script = self._start_script('0')
+        stdout, unused_stderr = script.communicate(timeout=10)
+        self.assertEqual(f'{script.pid} \n', stdout)
+        # The other command was still running in the daemon.
+        self.assertIsNone(slow_script.poll())
+        with open(release_path, 'w'):
+            pass
+        slow_script.communicate(timeout=10)
+        self.assertEqual(0, slow_script.returncode)
+
+    def test_no_daemon(self) -> None:
+        """Do not forward anything when the daemon is not running."""
+
+        self.assertIsNone(ci_daemon._forward(self._socket_path, _GET_DEMO_VARS_PATH, ['repo']))
+
+    @mock.patch('subprocess.Popen')
+    @mock.patch('tempfile.gettempdir')
+    def test_shared_folder(
+            self, mock_gettempdir: mock.MagicMock, mock_popen: mock.MagicMock) -> None:
+        """Run the script in-process when the socket folder could be used by others."""
+
+        mock_gettempdir.return_value = path.dirname(self._socket_path)
+        folder = path.join(path.dirname(self._socket_path), f'bayes-ci-{os.getuid()}')
+        os.mkdir(folder)
+        os.chmod(folder, 0o777)
+        with mock.patch.dict(os.environ, {'BAYES_CI_DAEMON': '1'}), \
+                mock.patch.object(ci_daemon, '_forward') as mock_forward:
+            os.environ.pop('BAYES_CI_SOCKET', None)
+            ci_daemon.forward_to_daemon(_GET_DEMO_VARS_PATH)
+            self.assertFalse(mock_forward.called)
+            self.assertFalse(mock_popen.called)
+
+            os.chmod(folder, 0o700)
+            self.assertEqual(path.join(folder, 'daemon.sock'), ci_daemon._get_socket_path())
+
+    @mock.patch('subprocess.Popen')
+    def test_start_daemon(self, mock_popen: mock.MagicMock) -> None:
+        """Start the daemon for the next calls, and let the script run in-process."""
+
+        with mock.patch.dict(os.environ, {'BAYES_CI_SOCKET': self._socket_path}):
+            ci_daemon.forward_to_daemon(_GET_DEMO_VARS_PATH)
+            self.assertFalse(mock_popen.called)
+
+            with mock.patch.dict(os.environ, {'BAYES_CI_DAEMON': '1'}):
+                ci_daemon.forward_to_daemon(_GET_DEMO_VARS_PATH)
+        self.assertEqual(
+            ['--socket', self._socket_path], mock_popen.call_args.args[0][-2:])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""Tests for the create_demo_statuses script."""
+
+from importlib import abc
+from importlib import util
+import json
+import os
+from os import path
+import sys
+import threading
+import typing
+from typing import Any
+import unittest
+from unittest import mock
+from urllib import error
+from urllib import request
+
+if typing.TYPE_CHECKING:
+    from bin import create_demo_statuses
+else:
+    _BIN_PATH = f'{path.dirname(path.dirname(path.abspath(__file__)))}/bin'
+    sys.path.insert(0, _BIN_PATH)
+    _SCRIPT_PATH = f'{_BIN_PATH}/create_demo_statuses.py'
+    _SCRIPT_SPEC = util.spec_from_file_location('create_demo_statuses.py', _SCRIPT_PATH)
+    assert _SCRIPT_SPEC
+    create_demo_statuses = util.module_from_spec(_SCRIPT_SPEC)
+    typing.cast(abc.Loader, _SCRIPT_SPEC.loader).exec_module(create_demo_statuses)
+
+_CIRCLE_ENV = {
+    'CIRCLE_PROJECT_USERNAME': 'bayesimpact',
+    'CIRCLE_PROJECT_REPONAME': 'docker-circleci',
+    'CIRCLE_PULL_REQUEST': 'https://github.com/bayesimpact/docker-circleci/pull/42',
+    'GITHUB_TOKEN': 'my-token',
+}
+
+
+def _make_deployments_response(*deployments: dict[str, Any]) -> mock.MagicMock:
+    response = mock.MagicMock()
+    response.json.return_value = {'data': {'repository': {'pullRequest': {
+        'commits': {'nodes': [{'commit': {'messageBody': 'PATH=/eval'}}]},
+        'timelineItems': {'nodes': [{'deployment': deployment} for deployment in deployments]},
+    }}}}
+    return response
+
+
+@mock.patch.dict(os.environ, _CIRCLE_ENV)
+@mock.patch('time.sleep')
+@mock.patch('requests.Session.post')
+class WaitForDeploymentsTestCase(unittest.TestCase):
+    """Tests for the wait_for_deployment_urls function."""
+
+    def test_poll_until_ready(
+            self, mock_post: mock.MagicMock, mock_sleep: mock.MagicMock) -> None:
+        """Poll with a growing interval until deployments are ready."""
+
+        mock_post.side_effect = [
+            _make_deployments_response({'description': 'Frontend', 'state': 'PENDING'}),
+            _make_deployments_response({'description': 'Frontend', 'state': 'IN_PROGRESS'}),
+            _make_deployments_response({
+                'description': 'Frontend',
+                'latestStatus': {'environmentUrl': 'https://frontend.example.com'},
+                'state': 'ACTIVE',
+            }),
+        ]
+        self.assertEqual(
+            {'frontend': 'https://frontend.example.com/eval'},
+            create_demo_statuses.wait_for_deployment_urls({'frontend'}))
+        self.assertEqual(
+            [True, False, False],
+            [call.kwargs['json']['variables']['withCommit'] for call in mock_post.call_args_list])
+        first_sleep, second_sleep = (call.args[0] for call in mock_sleep.call_args_list)
+        self.assertLessEqual(first_sleep, 2)
+        self.assertLessEqual(second_sleep, 4)
+        self.assertGreaterEqual(second_sleep, 2)
+
+    def test_redeploy(self, mock_post: mock.MagicMock, unused_mock_sleep: mock.MagicMock) -> None:
+        """Only log the final state of a deployment, after an older one failed."""
+
+        failed = {'description': 'Frontend', 'state': 'FAILURE'}
+        mock_post.side_effect = [
+            _make_deployments_response(failed, {'description': 'Frontend', 'state': 'PENDING'}),
+            _make_deployments_response(failed, {
+                'description': 'Frontend',
+                'latestStatus': {'environmentUrl': 'https://frontend.example.com'},
+                'state': 'ACTIVE',
+            }),
+        ]
+        with self.assertLogs(level='INFO') as logs:
+            self.assertEqual(
+                {'frontend': 'https://frontend.example.com/eval'},
+                create_demo_statuses.wait_for_deployment_urls({'frontend'}))
+        self.assertEqual(1, len(logs.output), msg=logs.output)
+        self.assertIn('Deployment "frontend" is ready after', logs.output[0])
+
+    @mock.patch('time.monotonic')
+    def test_timeout(
+            self, mock_monotonic: mock.MagicMock, mock_post: mock.MagicMock,
+            mock_sleep: mock.MagicMock) -> None:
+        """Stop polling after the deadline."""
+
+        mock_monotonic.side_effect = [0, 40, 65]
+        mock_post.return_value = _make_deployments_response(
+            {'description': 'Frontend', 'state': 'FAILURE'},
+            {'description': 'Backend', 'state': 'QUEUED'})
+        self.assertEqual(
+            {'frontend': None},
+            create_demo_statuses.wait_for_deployment_urls({'frontend', 'backend'}, timeout=60))
+        self.assertEqual(2, mock_post.call_count)
+        self.assertEqual(1, mock_sleep.call_count)
+
+
+def _post_events(port: int, *events: dict[str, Any]) -> None:
+    """A stand-in for the deployment tooling, forwarding deployment_status events."""
+
+    for event in events:
+        request.urlopen(request.Request(
+            f'http://localhost:{port}', data=json.dumps(event).encode(), method='POST',
+            headers={'Content-Type': 'application/json'}))
+
+
+@mock.patch.dict(os.environ, _CIRCLE_ENV | {'CIRCLE_SHA1': 'my-sha'})
+@mock.patch('requests.Session.get')
+class DeploymentEventsTestCase(unittest.TestCase):
+    """Tests for the deployment events receiver."""
+
+    def setUp(self) -> None:
+        super().setUp()
+        self._receiver = create_demo_statuses.DeploymentEventsReceiver()
+        self.addCleanup(self._receiver.close)
+
+    def test_events(self, mock_get: mock.MagicMock) -> None:
+        """Resolve deployments as soon as their events arrive."""
+
+        mock_get.return_value.json.return_value = {'commit': {'message': 'Title\n\nPATH=/eval'}}
+        poster = threading.Thread(target=_post_events, args=(
+            self._receiver.port,
+            {'deployment': {'description': 'Other'}, 'deployment_status': {'state': 'success'}},
+            {'deployment': {'description': 'Frontend'}, 'deployment_status': {'state': 'pending'}},
+            {
+                'deployment': {'description': 'Frontend', 'sha': 'deployed-sha'},
+                'deployment_status': {
+                    'environment_url': 'https://frontend.example.com',
+                    'state': 'success',
+                },
+            },
+            {'deployment': {'description': 'Backend'}, 'deployment_status': {'state': 'error'}},
+        ))
+        poster.start()
+        self.assertEqual(
+            {'backend': None, 'frontend': 'https://frontend.example.com/eval'},
+            self._receiver.wait_for_deployment_urls({'frontend', 'backend'}, timeout=10))
+        poster.join()
+        mock_get.assert_called_once_with(
+            'https://api.github.com/repos/bayesimpact/docker-circleci/commits/deployed-sha')
+
+    def test_invalid_events(self, mock_get: mock.MagicMock) -> None:
+        """Skip events without a description, and refuse payloads that are not objects."""
+
+        with self.assertRaises(error.HTTPError) as context:
+            _post_events(self._receiver.port, [1, 2])  # type: ignore[arg-type]
+        self.assertEqual(400, context.exception.code)
+        _post_events(
+            self._receiver.port,
+            {'deployment': {'description': None}, 'deployment_status': {'state': 'success'}},
+            {'deployment': None, 'deployment_status': None},
+            {'deployment': {'description': 'Frontend'}, 'deployment_status': {'state': 'error'}})
+        self.assertEqual(
+            {'frontend': None},
+            self._receiver.wait_for_deployment_urls({'frontend'}, timeout=10))
+        self.assertFalse(mock_get.called)
+
+    def test_timeout(self, mock_get: mock.MagicMock) -> None:
+        """Give up on deployments without events after the timeout."""
+
+        _post_events(self._receiver.port, {
+            'deployment': {'description': 'Frontend'},
+            'deployment_status': {'state': 'failure'},
+        })
+        self.assertEqual(
+            {'frontend': None},
+            self._receiver.wait_for_deployment_urls({'frontend', 'backend'}, timeout=.1))
+        self.assertFalse(mock_get.called)
+
+
+@mock.patch('requests.Session.post')
+@mock.patch('requests.Session.get')
+class CreateDemoStatusesTestCase(unittest.TestCase):
+    """Tests for the create_demo_statuses function."""
+
+    def test_skip_existing(self, mock_get: mock.MagicMock, mock_post: mock.MagicMock) -> None:
+        """Only create the statuses that are not on the commit yet."""
+
+        mock_get.return_value.json.return_value = {'statuses': [
+            {
+                'context': 'bayesimpact/demo-frontend',
+                'state': 'success',
+                'target_url': 'https://frontend.example.com',
+            },
+            {
+                'context': 'bayesimpact/demo-backend',
+                'state': 'success',
+                'target_url': 'https://old-backend.example.com',
+            },
+            {'context': 'bayesimpact/demo-failed', 'state': 'failure', 'target_url': None},
+            {'context': 'ci/circleci: test', 'state': 'success'},
+        ]}
+        create_demo_statuses.create_demo_statuses({
+            'backend': 'https://backend.example.com',
+            'failed': None,
+            'frontend': 'https://frontend.example.com',
+            'new': 'https://new.example.com',
+        })
+        self.assertEqual(
+            ['bayesimpact/demo-backend', 'bayesimpact/demo-new'],
+            sorted(call.kwargs['json']['context'] for call in mock_post.call_args_list))
+
+    def test_no_demos(self, mock_get: mock.MagicMock, mock_post: mock.MagicMock) -> None:
+        """Do not call Github at all when there are no demos."""
+
+        create_demo_statuses.create_demo_statuses({})
+        mock_get.assert_not_called()
+        mock_post.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""Tests for the docker_compose_up_remote_env script."""
+
+from importlib import abc
+from importlib import util
+import io
+import json
+import os
+from os import path
+import shutil
+import signal
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+import typing
+import unittest
+from unittest import mock
+
+import yaml
+
+if typing.TYPE_CHECKING:
+    from bin import docker_compose_up_remote_env
+else:
+    _BIN_PATH = f'{path.dirname(path.dirname(path.abspath(__file__)))}/bin'
+    sys.path.insert(0, _BIN_PATH)
+    _SCRIPT_PATH = f'{_BIN_PATH}/docker_compose_up_remote_env.py'
+    _SCRIPT_SPEC = util.spec_from_file_location('docker_compose_up_remote_env.py', _SCRIPT_PATH)
+    assert _SCRIPT_SPEC
+    docker_compose_up_remote_env = util.module_from_spec(_SCRIPT_SPEC)
+    typing.cast(abc.Loader, _SCRIPT_SPEC.loader).exec_module(docker_compose_up_remote_env)
+
+_Volume = docker_compose_up_remote_env._Volume
+
+_COMPOSE = '''
+x-common: &common
+  image: bayesimpact/base
+  entrypoint: ./entrypoint.sh --fast
+  volumes:
+    - ./cfg:/usr/app/cfg:ro
+services:
+  frontend:
+    <<: *common
+  backend:
+    image: bayesimpact/backend
+    volumes:
+      - data:/data
+      - type: bind
+        source: ./backend/settings.py
+        target: /work/settings.py
+'''
+
+
+class ComposeTestCase(unittest.TestCase):
+    """Tests for the parsing of the docker-compose file."""
+
+    _compose = yaml.safe_load(_COMPOSE)
+
+    def test_services(self) -> None:
+        """Get the volumes to copy and the entrypoint of services, whatever their syntax."""
+
+        frontend, backend = docker_compose_up_remote_env._iterate_services(
+            self._compose, ['frontend', 'backend'], '42')
+        self.assertEqual('frontend-42', frontend.container_id)
+        self.assertEqual([_Volume('./cfg', '/usr/app/cfg')], frontend.volumes)
+        self.assertEqual(['./entrypoint.sh', '--fast'], frontend.entrypoint)
+        self.assertEqual('backend-42', backend.container_id)
+        self.assertEqual([_Volume('./backend/settings.py', '/work/settings.py')], backend.volumes)
+        self.assertEqual([], backend.entrypoint)
+
+    def test_legacy_container_id(self) -> None:
+        """Accept a service and its container ID."""
+
+        services = list(docker_compose_up_remote_env._iterate_services(
+            self._compose, ['frontend', 'my-container'], '42'))
+        self.assertEqual(['my-container'], [service.container_id for service in services])
+        with self.assertRaises(ValueError):
+            list(docker_compose_up_remote_env._iterate_services(
+                self._compose, ['unknown-service'], '42'))
+
+    @mock.patch.dict(os.environ, {'HOME': '/home/bayes'})
+    def test_home_volume(self) -> None:
+        """Expand the home folder in the source of volumes."""
+
+        compose = {'services': {'frontend': {'volumes': ['~/cfg:/usr/app/cfg']}}}
+        frontend, = docker_compose_up_remote_env._iterate_services(compose, ['frontend'], '42')
+        self.assertEqual([_Volume('/home/bayes/cfg', '/usr/app/cfg')], frontend.volumes)
+
+    def test_alter(self) -> None:
+        """Remove the local volumes and the entrypoints."""
+
+        altered = docker_compose_up_remote_env._alter_compose(self._compose)
+        self.assertEqual({'image': 'bayesimpact/base'}, altered['services']['frontend'])
+        self.assertEqual(
+            {'image': 'bayesimpact/backend', 'volumes': ['data:/data']},
+            altered['services']['backend'])
+        # The original is kept.
+        self.assertIn('entrypoint', self._compose['services']['frontend'])
+
+
+class VolumesArchiveTestCase(unittest.TestCase):
+    """Tests for the archive of the volumes' files."""
+
+    def setUp(self) -> None:
+        super().setUp()
+        previous_dir = os.getcwd()
+        folder = tempfile.mkdtemp()
+        os.chdir(folder)
+        self.addCleanup(shutil.rmtree, folder)
+        self.addCleanup(os.chdir, previous_dir)
+
+    def test_archive(self) -> None:
+        """Put the files at their path in the container."""
+
+        os.makedirs('cfg/sub')
+        for name in ('cfg/sub/a.json', 'cfg/.env', 'settings.py'):
+            with open(name, 'w') as file:
+                file.write(name)
+        archive = io.BytesIO()
+        with self.assertLogs(level='WARNING'):
+            docker_compose_up_remote_env._write_volumes_archive([
+                _Volume('./cfg', '/usr/app/cfg'),
+                _Volume('./settings.py', '/work/settings.py'),
+                _Volume('./missing', '/missing'),
+            ], archive)
+        archive.seek(0)
+        with tarfile.open(fileobj=archive) as tar:
+            self.assertEqual([
+                'usr/app/cfg',
+                'usr/app/cfg/.env',
+                'usr/app/cfg/sub',
+                'usr/app/cfg/sub/a.json',
+                'work/settings.py',
+            ], sorted(tar.getnames()))
+            self.assertEqual({0}, {member.uid for member in tar.getmembers()})
+            settings = tar.extractfile('work/settings.py')
+            assert settings
+            self.assertEqual(b'settings.py', settings.read())
+
+    def _read_archive(self, archive: io.BytesIO) -> dict[str, bytes]:
+        archive.seek(0)
+        with tarfile.open(fileobj=archive) as tar:
+            return {
+                member.name: file.read() if (file := tar.extractfile(member)) else b''
+                for member in tar.getmembers()
+            }
+
+    def test_sync(self) -> None:
+        """Only write the files that changed since the previous sync."""
+
+        os.makedirs('cfg/sub')
+        for name in ('cfg/sub/a.json', 'cfg/b.json', 'settings.py'):
+            with open(name, 'w') as file:
+                file.write(name)
+        volumes = [_Volume('./cfg', '/usr/app/cfg'), _Volume('./settings.py', '/settings.py')]
+
+        archive = io.BytesIO()
+        with self.assertLogs(level='INFO'):
+            self.assertEqual([], docker_compose_up_remote_env._write_volumes_delta(
+                volumes, {}, archive))
+        files = self._read_archive(archive)
+        self.assertEqual([
+            '.bayes-ci-volumes-manifest.json',
+            'settings.py',
+            'usr/app/cfg',
+            'usr/app/cfg/b.json',
+            'usr/app/cfg/sub',
+            'usr/app/cfg/sub/a.json',
+        ], sorted(files))
+        manifest = json.loads(files['.bayes-ci-volumes-manifest.json'])
+        self.assertEqual(
+            sorted(files), sorted(list(manifest) + ['.bayes-ci-volumes-manifest.json']))
+
+        with open('cfg/b.json', 'w') as file:
+            file.write('changed')
+        # Touched, but not changed.
+        os.utime('settings.py', ns=(0, 0))
+        os.remove('cfg/sub/a.json')
+        archive = io.BytesIO()
+        with self.assertLogs(level='INFO'):
+            removed = docker_compose_up_remote_env._write_volumes_delta(volumes, manifest, archive)
+        self.assertEqual(['usr/app/cfg/sub/a.json'], removed)
+        files = self._read_archive(archive)
+        self.assertEqual(
+            ['.bayes-ci-volumes-manifest.json', 'usr/app/cfg/b.json'], sorted(files))
+        self.assertEqual(b'changed', files['usr/app/cfg/b.json'])
+        manifest = json.loads(files['.bayes-ci-volumes-manifest.json'])
+        self.assertEqual(0, manifest['settings.py']['mtime'])
+
+    def _sync_running_backend(
+            self, mock_run: mock.MagicMock, mock_popen: mock.MagicMock,
+            manifest: typing.Optional[dict[str, typing.Any]]) -> list[list[str]]:
+        """Sync the backend service in a running container with the given manifest."""
+
+        def _run(command: list[str], **unused_kwargs: typing.Any) -> mock.MagicMock:
+            result = mock.MagicMock(returncode=0)
+            if command[:2] == ['docker', 'inspect']:
+                result.stdout = 'true\n'
+            elif command[-1] == '/.bayes-ci-volumes-manifest.json':
+                result.returncode = 0 if manifest is not None else 1
+                result.stdout = json.dumps(manifest).encode()
+            return result
+
+        with open('docker-compose.yml', 'w') as file:
+            file.write(_COMPOSE)
+        mock_popen.return_value.__enter__.return_value.returncode = 0
+        mock_run.side_effect = _run
+        with self.assertLogs(level='INFO'):
+            docker_compose_up_remote_env.main(['--sync', 'backend'])
+        self.assertEqual(1, mock_popen.call_count)
+        return [call.args[0] for call in mock_run.call_args_list]
+
+    @mock.patch.dict(os.environ, {'CIRCLE_BUILD_NUM': '42'})
+    @mock.patch('subprocess.Popen')
+    @mock.patch('subprocess.run')
+    def test_sync_running_service(
+            self, mock_run: mock.MagicMock, mock_popen: mock.MagicMock) -> None:
+        """Reuse the running container, and remove the files that are gone."""
+
+        self.assertEqual(
+            [
+                ['docker', 'inspect', '-f', '{{.State.Running}}', 'backend-42'],
+                ['docker', 'exec', 'backend-42', 'cat', '/.bayes-ci-volumes-manifest.json'],
+                ['docker', 'exec', 'backend-42', 'rm', '-rf', '--', '/work/gone.py'],
+            ],
+            self._sync_running_backend(mock_run, mock_popen, {'work/gone.py': {}}))
+
+    @mock.patch.dict(os.environ, {'CIRCLE_BUILD_NUM': '42'})
+    @mock.patch('subprocess.Popen')
+    @mock.patch('subprocess.run')
+    def test_sync_without_manifest(
+            self, mock_run: mock.MagicMock, mock_popen: mock.MagicMock) -> None:
+        """Reuse the running container, and sync all files when it has no manifest."""
+
+        with mock.patch.object(
+                docker_compose_up_remote_env, '_write_volumes_delta',
+                return_value=[]) as mock_write_delta:
+            commands = self._sync_running_backend(mock_run, mock_popen, None)
+        self.assertEqual(
+            [
+                ['docker', 'inspect', '-f', '{{.State.Running}}', 'backend-42'],
+                ['docker', 'exec', 'backend-42', 'cat', '/.bayes-ci-volumes-manifest.json'],
+            ],
+            commands)
+        self.assertEqual({}, mock_write_delta.call_args.args[1])
+
+    @mock.patch.dict(os.environ, {'CIRCLE_BUILD_NUM': '42'})
+    @mock.patch('subprocess.Popen')
+    @mock.patch('subprocess.run')
+    def test_start_services(self, mock_run: mock.MagicMock, mock_popen: mock.MagicMock) -> None:
+        """Start all services, each with a single copy of its volumes."""
+
+        with open('docker-compose.yml', 'w') as file:
+            file.write(_COMPOSE)
+        mock_popen.return_value.__enter__.return_value.returncode = 0
+        with self.assertLogs(level='INFO'):
+            docker_compose_up_remote_env.main(['frontend', 'backend'])
+        self.assertEqual(2, mock_popen.call_count)
+        self.assertEqual(
+            [
+                ['docker', 'exec', '-t', 'frontend-42', './entrypoint.sh', '--fast'],
+            ],
+            [call.args[0] for call in mock_run.call_args_list if call.args[0][0] == 'docker'])
+        # Containers are started one after the other, before the copies.
+        compose_runs = mock_run.call_args_list[:2]
+        self.assertEqual(
+            [('docker-compose', 'frontend'), ('docker-compose', 'backend')],
+            [(run.args[0][0], run.args[0][run.args[0].index('-d') + 1]) for run in compose_runs])
+        compose_run = compose_runs[0]
+        self.assertIn('bayes-ci.build=42', compose_run.args[0])
+        altered = yaml.safe_load(compose_run.kwargs['input'])
+        self.assertNotIn('entrypoint', altered['services']['frontend'])
+
+
+class KeepAliveTestCase(unittest.TestCase):
+    """Tests for the main process of the containers."""
+
+    def _start(self, max_lifetime: int) -> subprocess.Popen[bytes]:
+        process = subprocess.Popen([
+            '/bin/sh', '-c', docker_compose_up_remote_env._KEEP_ALIVE_SCRIPT, 'keep-alive',
+            str(max_lifetime),
+        ])
+        self.addCleanup(process.kill)
+        return process
+
+    def _wait_for_handler(self, pid: int, signal_number: int) -> None:
+        """Wait for a process to catch a signal, as listed in its /proc status."""
+
+        for unused_ in range(500):
+            with open(f'/proc/{pid}/status') as status:
+                caught = next(
+                    int(line.split()[1], 16) for line in status if line.startswith('SigCgt:'))
+            if caught & (1 << (signal_number - 1)):
+                return
+            time.sleep(.01)
+        self.fail(f'The process does not catch signal {signal_number}.')
+
+    def test_max_lifetime(self) -> None:
+        """Stop after the max lifetime."""
+
+        self.assertEqual(0, self._start(max_lifetime=0).wait(timeout=5))
+
+    def test_signal(self) -> None:
+        """Stop right away on SIGTERM."""
+
+        process = self._start(max_lifetime=60)
+        self._wait_for_handler(process.pid, signal.SIGTERM)
+        process.send_signal(signal.SIGTERM)
+        self.assertEqual(0, process.wait(timeout=2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,6 +8,7 @@ import os
 from os import path
 import shutil
 import subprocess
+import sys
 import tempfile
 import types
 import typing
@@ -15,6 +16,8 @@ from typing import Iterator, Optional
 import unittest
 from unittest import mock
 
+import requests
+
 if typing.TYPE_CHECKING:
     class _GetDemoVars(types.ModuleType):
         # pylint: disable=invalid-name
@@ -23,12 +26,12 @@ if typing.TYPE_CHECKING:
                 env: Optional[dict[str, str]] = None) -> str:
             """Run the get_demo_vars script."""
 
-        requests: types.ModuleType
-
 if typing.TYPE_CHECKING:
     from bin import get_demo_vars
 else:
-    _SCRIPT_PATH = f'{path.dirname(path.dirname(path.abspath(__file__)))}/bin/get_demo_vars.py'
+    _BIN_PATH = f'{path.dirname(path.dirname(path.abspath(__file__)))}/bin'
+    sys.path.insert(0, _BIN_PATH)
+    _SCRIPT_PATH = f'{_BIN_PATH}/get_demo_vars.py'
     _SCRIPT_SPEC = util.spec_from_file_location('get_demo_vars.py', _SCRIPT_PATH)
     assert _SCRIPT_SPEC
     get_demo_vars = typing.cast('_GetDemoVars', util.module_from_spec(_SCRIPT_SPEC))
@@ -81,9 +84,13 @@ class DemoVarsTestCase(unittest.TestCase):
         os.chdir(cls._previous_dir)
         shutil.rmtree(cls._dir, ignore_errors=True)
 
-    @staticmethod
+    def setUp(self) -> None:
+        super().setUp()
+        self._cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._cache_dir)
+
     def _run_with_branch_and_tag(
-            var: Optional[str] = None, *,
+            self, var: Optional[str] = None, *,
             branch: str = '', tag: str = '', env: Optional[dict[str, str]] = None) -> str:
         return get_demo_vars.main([var] if var else None, {
             'CIRCLE_BRANCH': branch,
@@ -91,6 +98,7 @@ class DemoVarsTestCase(unittest.TestCase):
             'CIRCLE_PROJECT_REPONAME': 'bob',
             'CIRCLE_PROJECT_USERNAME': 'bayes',
             'CIRCLE_WORKFLOW_ID': '',
+            'DEMO_VARS_CACHE_DIR': self._cache_dir,
         } | (env or {}))
 
     def test_default_branch(self) -> None:
@@ -124,7 +132,7 @@ class DemoVarsTestCase(unittest.TestCase):
                 'repo=bayes%2Fbob&branch=bayes%3Acyrille-path&path=%2Feval',
                 self._run_with_branch_and_tag(branch='cyrille-path'))
 
-    @mock.patch(get_demo_vars.requests.__name__ + '.get')
+    @mock.patch('requests.Session.get', autospec=True)
     def test_with_demo_waiter(self, mock_get: mock.MagicMock) -> None:
         """Yield a ci_callback_url when there's a wait-for-demo approval in workflow."""
 
@@ -142,11 +150,11 @@ class DemoVarsTestCase(unittest.TestCase):
                     'CIRCLE_WORKFLOW_ID': 'my-workflow-id',
                     'CIRCLE_API_TOKEN': 'my-circle-token',
                 }))
-            mock_get.assert_called_with(
-                'https://circleci.com/api/v2/workflow/my-workflow-id/job',
-                headers={'Circle-Token': 'my-circle-token'})
+            session, url = mock_get.call_args.args
+            self.assertEqual('https://circleci.com/api/v2/workflow/my-workflow-id/job', url)
+            self.assertEqual('my-circle-token', session.headers['Circle-Token'])
 
-    @mock.patch(get_demo_vars.requests.__name__ + '.get')
+    @mock.patch('requests.Session.get', autospec=True)
     def test_without_demo_waiter(self, mock_get: mock.MagicMock) -> None:
         """Yield a ci_callback_url when there's a wait-for-demo approval in workflow."""
 
@@ -159,9 +167,127 @@ class DemoVarsTestCase(unittest.TestCase):
             'CIRCLE_WORKFLOW_ID': 'my-workflow-id',
             'CIRCLE_API_TOKEN': 'my-circle-token',
         }))
-        mock_get.assert_called_with(
-            'https://circleci.com/api/v2/workflow/my-workflow-id/job',
-            headers={'Circle-Token': 'my-circle-token'})
+        session, url = mock_get.call_args.args
+        self.assertEqual('https://circleci.com/api/v2/workflow/my-workflow-id/job', url)
+        self.assertEqual('my-circle-token', session.headers['Circle-Token'])
+
+    @mock.patch('requests.Session.get', autospec=True)
+    def test_cache(self, mock_get: mock.MagicMock) -> None:
+        """Compute the variables only once per build."""
+
+        mock_get.return_value.json.return_value = {'items': []}
+        env = {
+            'CIRCLE_API_TOKEN': 'my-circle-token',
+            'CIRCLE_SHA1': 'my-sha1',
+            'CIRCLE_WORKFLOW_ID': 'my-workflow-id',
+        }
+        with simple_branch('cyrille-cache'):
+            _run_git('commit', '-nm', 'A commit.\n\nPATH=/eval')
+            self.assertEqual(
+                '/eval', self._run_with_branch_and_tag('path', branch='cyrille-cache', env=env))
+            with mock.patch.object(get_demo_vars, '_run_git') as mock_run_git:
+                self.assertEqual(
+                    'bayes/bob',
+                    self._run_with_branch_and_tag('repo', branch='cyrille-cache', env=env))
+                self.assertFalse(mock_run_git.called)
+            # Another workflow on the same commit.
+            self.assertEqual('', self._run_with_branch_and_tag(
+                'path', branch='main', env=env | {'CIRCLE_WORKFLOW_ID': 'other-workflow-id'}))
+            self.assertEqual(2, mock_get.call_count)
+            # Another build in the same workflow.
+            self.assertEqual('', self._run_with_branch_and_tag(
+                'path', branch='main', env=env | {'CIRCLE_SHA1': 'other-sha1'}))
+        self.assertEqual(2, mock_get.call_count)
+
+    def test_env_format(self) -> None:
+        """Return all the variables as shell assignments."""
+
+        with simple_branch('cyrille-env'):
+            _run_git('commit', '-nm', "A commit.\n\nPATH=/eval\nA=it's\nB=2")
+            self.assertEqual(
+                "DEMO_REPO=bayes/bob\n"
+                "DEMO_BRANCH=bayes:cyrille-env\n"
+                "DEMO_PATH=/eval\n"
+                "DEMO_OVERRIDE='A:it'\"'\"'s\nB:2'\n"
+                "DEMO_VARS='repo=bayes%2Fbob&branch=bayes%3Acyrille-env&path=%2Feval"
+                "&override=A%3Ait%27s&override=B%3A2'",
+                self._run_with_branch_and_tag('--format=env', branch='cyrille-env'))
+            self.assertEqual(
+                'DEMO_PATH=/eval',
+                get_demo_vars.main(['path', '--format=env'], {
+                    'CIRCLE_BRANCH': 'cyrille-env',
+                    'DEMO_VARS_CACHE_DIR': self._cache_dir,
+                }))
+
+    @mock.patch('requests.Session.get', autospec=True)
+    def test_demo_waiter_pages(self, mock_get: mock.MagicMock) -> None:
+        """Look for the wait-for-demo approval in the next pages, until it's found."""
+
+        mock_get.return_value.json.side_effect = [
+            {'items': [{'name': 'build', 'type': 'build'}], 'next_page_token': 'page-2'},
+            {
+                'items': [{
+                    'approval_request_id': 'i-approve-this',
+                    'name': 'wait-for-demo',
+                    'type': 'approval',
+                }],
+                'next_page_token': 'page-3',
+            },
+        ]
+        env = {'CIRCLE_WORKFLOW_ID': 'my-workflow-id', 'CIRCLE_API_TOKEN': 'my-circle-token'}
+        self.assertEqual(
+            'https://circleci.com/api/v2/workflow/my-workflow-id/approve/i-approve-this',
+            self._run_with_branch_and_tag('ci_callback_url', tag='release', env=env))
+        self.assertEqual(
+            [None, {'page-token': 'page-2'}],
+            [call.kwargs['params'] for call in mock_get.call_args_list])
+        # The approval is cached for the whole workflow.
+        self.assertEqual(
+            'https://circleci.com/api/v2/workflow/my-workflow-id/approve/i-approve-this',
+            self._run_with_branch_and_tag(
+                'ci_callback_url', tag='release', env=env | {'CIRCLE_API_TOKEN': ''}))
+        self.assertEqual(2, mock_get.call_count)
+
+    @mock.patch('requests.Session.get', autospec=True)
+    def test_demo_waiter_error(self, mock_get: mock.MagicMock) -> None:
+        """Do not yield a ci_callback_url if the jobs cannot be listed."""
+
+        mock_get.return_value.raise_for_status.side_effect = requests.HTTPError('404 Not Found')
+        env = {'CIRCLE_WORKFLOW_ID': 'my-workflow-id', 'CIRCLE_API_TOKEN': 'my-circle-token'}
+        with self.assertLogs(level='WARNING'):
+            self.assertEqual('', self._run_with_branch_and_tag(tag='release', env=env))
+        # Errors are not cached.
+        mock_get.return_value.raise_for_status.side_effect = None
+        mock_get.return_value.json.return_value = {'items': [{
+            'approval_request_id': 'i-approve-this',
+            'name': 'wait-for-demo',
+            'type': 'approval',
+        }]}
+        self.assertTrue(self._run_with_branch_and_tag(tag='release', env=env))
+
+    @mock.patch('requests.Session.get', autospec=True)
+    def test_demo_waiter_error_in_build(self, mock_get: mock.MagicMock) -> None:
+        """Do not cache the variables of a build if the jobs cannot be listed."""
+
+        mock_get.return_value.raise_for_status.side_effect = requests.HTTPError('404 Not Found')
+        env = {
+            'CIRCLE_API_TOKEN': 'my-circle-token',
+            'CIRCLE_SHA1': 'my-sha1',
+            'CIRCLE_WORKFLOW_ID': 'my-workflow-id',
+        }
+        with self.assertLogs(level='WARNING'):
+            self.assertEqual('', self._run_with_branch_and_tag(
+                'ci_callback_url', tag='release', env=env))
+        mock_get.return_value.raise_for_status.side_effect = None
+        mock_get.return_value.json.return_value = {'items': [{
+            'approval_request_id': 'i-approve-this',
+            'name': 'wait-for-demo',
+            'type': 'approval',
+        }]}
+        self.assertEqual(
+            'https://circleci.com/api/v2/workflow/my-workflow-id/approve/i-approve-this',
+            self._run_with_branch_and_tag('ci_callback_url', tag='release', env=env))
+        self.assertEqual(2, mock_get.call_count)
 
     def test_without_circle_token(self) -> None:
         """Yield a ci_callback_url when there's a wait-for-demo approval in workflow."""
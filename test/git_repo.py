@@ -0,0 +1,41 @@
+"""A git repository in a temporary folder, shared by the tests of a test case."""
+
+import os
+import subprocess
+import tempfile
+import typing
+import unittest
+from unittest import mock
+
+
+def run_git(*command: str) -> str:
+    """Run a git command with a test identity, and return its output."""
+
+    return subprocess.check_output(
+        ['git', '-c', 'user.email=test@example.com', '-c', 'user.name=TEST'] + list(command),
+        text=True).strip()
+
+
+def commit(message: str, timestamp: typing.Optional[int] = None) -> None:
+    """Commit all the changes in the working tree, at the given time in seconds since epoch."""
+
+    run_git('add', '--all')
+    env = {'GIT_COMMITTER_DATE': f'{timestamp} +0000'} if timestamp is not None else {}
+    with mock.patch.dict(os.environ, env):
+        run_git('commit', '-qnm', message)
+
+
+class GitRepoTestCase(unittest.TestCase):
+    """A test case running in a new git repository, created for the whole class."""
+
+    repo_dir = ''
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        repo_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        cls.addClassCleanup(repo_dir.cleanup)
+        cls.addClassCleanup(os.chdir, os.getcwd())
+        cls.repo_dir = repo_dir.name
+        os.chdir(cls.repo_dir)
+        run_git('init', '-q')
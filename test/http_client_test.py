@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""Tests for the http_client module."""
+
+from http import server
+import os
+from os import path
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import typing
+import unittest
+from unittest import mock
+
+import requests
+from requests import adapters
+from urllib3 import util
+
+if typing.TYPE_CHECKING:
+    from bin import http_client
+else:
+    sys.path.insert(0, f'{path.dirname(path.dirname(path.abspath(__file__)))}/bin')
+    import http_client
+
+
+def _make_response(
+        headers: dict[str, str], json: typing.Any = None, *,
+        status_code: int = 200, content: bytes = b'') -> requests.Response:
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = content  # pylint: disable=protected-access
+    response.headers.update(headers)
+    if json is not None:
+        response.json = lambda **unused_kwargs: json  # type: ignore[method-assign]
+    return response
+
+
+class GithubSchedulerTestCase(unittest.TestCase):
+    """Tests for the Github rate limit scheduler."""
+
+    @mock.patch('time.sleep')
+    def test_plenty_of_budget(self, mock_sleep: mock.MagicMock) -> None:
+        """Do not wait when there's enough budget left."""
+
+        scheduler = http_client._GithubScheduler()
+        scheduler.record('core', _make_response({
+            'X-RateLimit-Limit': '5000',
+            'X-RateLimit-Remaining': '4000',
+            'X-RateLimit-Reset': str(int(time.time()) + 600),
+        }))
+        scheduler.wait_for_budget('core')
+        self.assertFalse(mock_sleep.called)
+        self.assertEqual(1, scheduler.calls)
+        self.assertEqual(1, scheduler.points)
+
+    @mock.patch('time.sleep')
+    def test_spread_low_budget(self, mock_sleep: mock.MagicMock) -> None:
+        """Spread the calls until the reset time when the budget is low."""
+
+        scheduler = http_client._GithubScheduler()
+        scheduler.record('core', _make_response({
+            'X-RateLimit-Limit': '5000',
+            'X-RateLimit-Remaining': '99',
+            'X-RateLimit-Reset': str(int(time.time()) + 200),
+        }))
+        scheduler.wait_for_budget('core')
+        delay = mock_sleep.call_args.args[0]
+        self.assertGreater(delay, 1.5)
+        self.assertLessEqual(delay, 2)
+        self.assertEqual(delay, scheduler.waited_seconds)
+        # Another resource is not throttled.
+        mock_sleep.reset_mock()
+        scheduler.wait_for_budget('search')
+        self.assertFalse(mock_sleep.called)
+
+    @mock.patch('time.sleep')
+    def test_graphql_cost(self, mock_sleep: mock.MagicMock) -> None:
+        """Count the points spent by GraphQL queries."""
+
+        scheduler = http_client._GithubScheduler()
+        scheduler.record('graphql', _make_response({
+            'X-RateLimit-Limit': '5000',
+            'X-RateLimit-Remaining': '4000',
+            'X-RateLimit-Reset': str(int(time.time()) + 600),
+        }, {'data': {'rateLimit': {
+            'cost': 3,
+            'remaining': 2,
+            'resetAt': '2999-01-01T00:00:00Z',
+        }}}))
+        self.assertEqual(3, scheduler.points)
+        # Too long to wait for the reset.
+        scheduler.wait_for_budget('graphql')
+        self.assertFalse(mock_sleep.called)
+
+
+class HttpCacheTestCase(unittest.TestCase):
+    """Tests for the on-disk HTTP cache."""
+
+    def setUp(self) -> None:
+        super().setUp()
+        self._folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._folder)
+
+    def test_revalidate(self) -> None:
+        """Serve the cached content when the server answers "Not Modified"."""
+
+        cache = http_client._HttpCache(self._folder, 1024)
+        self.assertIsNone(cache.load('my-url'))
+        cache.update('my-url', None, _make_response(
+            {'ETag': '"abc"', 'Link': '<next-url>; rel="next"'}, content=b'[1, 2]'))
+        entry = cache.load('my-url')
+        assert entry
+        self.assertEqual({'If-None-Match': '"abc"'}, entry.get_validators())
+
+        response = cache.update('my-url', entry, _make_response(
+            {'X-RateLimit-Remaining': '10'}, status_code=304))
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([1, 2], response.json())
+        self.assertEqual('next-url', response.links['next']['url'])
+        self.assertEqual('10', response.headers['X-RateLimit-Remaining'])
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+
+    def test_evict(self) -> None:
+        """Remove the least recently used entries when the cache is full."""
+
+        cache = http_client._HttpCache(self._folder, 150)
+        for key in ('old', 'recent'):
+            cache.update(key, None, _make_response({'ETag': key}, content=b'a' * 50))
+            os.utime(cache._get_path(key), (time.time() - 10, time.time() - 10))
+        # Use the old one, so that it is not the least recently used anymore.
+        cache.update('old', cache.load('old'), _make_response({}, status_code=304))
+        cache.update('new', None, _make_response({'ETag': 'new'}, content=b'a' * 50))
+        self.assertTrue(cache.load('old'))
+        self.assertFalse(cache.load('recent'))
+        self.assertTrue(cache.load('new'))
+
+    def test_environment(self) -> None:
+        """Use the cache folder of the current environment, and summarize each use separately."""
+
+        self.addCleanup(http_client._GITHUB_CACHES.clear)
+        other_folder = path.join(self._folder, 'other')
+        with mock.patch.dict(os.environ, {'GITHUB_CACHE_DIR': self._folder}):
+            cache = http_client._get_github_cache()
+        with mock.patch.dict(os.environ, {'GITHUB_CACHE_DIR': other_folder}):
+            other_cache = http_client._get_github_cache()
+        assert cache and other_cache
+        self.assertEqual(other_folder, other_cache._folder)
+        self.assertIsNot(cache, other_cache)
+
+        cache.update('my-url', None, _make_response({'ETag': '"abc"'}))
+        with self.assertLogs(level='INFO') as logs:
+            http_client.log_summary()
+        self.assertIn('Github cache: 0 hits out of 1 requests (0%).', logs.output[0])
+        self.assertEqual((0, 0), (cache.hits, cache.misses))
+
+
+class _SecondaryRateLimitHandler(server.BaseHTTPRequestHandler):
+    """Answer as Github does when hitting a secondary rate limit, and then OK."""
+
+    calls = 0
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        """Reply to a GET request."""
+
+        type(self).calls += 1
+        if self.calls == 1:
+            self.send_response(403)
+            self.send_header('Retry-After', '0')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    # pylint: disable=redefined-builtin
+    def log_message(self, format: str, *args: typing.Any) -> None:
+        pass
+
+
+def _get_retry(session: requests.Session, url: str) -> util.Retry:
+    return typing.cast(adapters.HTTPAdapter, session.get_adapter(url)).max_retries
+
+
+class RetryTestCase(unittest.TestCase):
+    """Tests for the retry policy of the sessions."""
+
+    def test_retry_after(self) -> None:
+        """Retry a 403 answered with a Retry-After header."""
+
+        with server.HTTPServer(('127.0.0.1', 0), _SecondaryRateLimitHandler) as http_server:
+            threading.Thread(target=http_server.serve_forever, daemon=True).start()
+            self.addCleanup(http_server.shutdown)
+            url = f'http://127.0.0.1:{http_server.server_port}/repos'
+            response = http_client.get_session(url).get(url)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(2, _SecondaryRateLimitHandler.calls)
+
+    def test_no_retry_on_forbidden(self) -> None:
+        """Do not retry a plain 403."""
+
+        retry = _get_retry(
+            http_client.github_session('my-token'), 'https://api.github.com/graphql')
+        self.assertTrue(retry.is_retry('GET', 403, has_retry_after=True))
+        self.assertFalse(retry.is_retry('GET', 403, has_retry_after=False))
+
+    def test_post_retries(self) -> None:
+        """Only retry POSTs to Github, not to Slack."""
+
+        github_retry = _get_retry(
+            http_client.github_session('my-token'), 'https://api.github.com/graphql')
+        self.assertTrue(github_retry.is_retry('POST', 502))
+        slack_url = 'https://hooks.slack.com/services/my-hook'
+        slack_retry = _get_retry(http_client.get_session(slack_url), slack_url)
+        self.assertFalse(slack_retry.is_retry('POST', 502))
+        self.assertTrue(slack_retry.is_retry('GET', 502))
+
+
+if __name__ == '__main__':
+    unittest.main()
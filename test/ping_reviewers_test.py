@@ -6,15 +6,19 @@ from importlib import util
 import os
 from os import path
 import shutil
+import sys
 import time
 import typing
+from typing import Optional
 import unittest
 from unittest import mock
 
 if typing.TYPE_CHECKING:
     from bin import ping_reviewers
 else:
-    _SCRIPT_PATH = f'{path.dirname(path.dirname(path.abspath(__file__)))}/bin/ping_reviewers.py'
+    _BIN_PATH = f'{path.dirname(path.dirname(path.abspath(__file__)))}/bin'
+    sys.path.insert(0, _BIN_PATH)
+    _SCRIPT_PATH = f'{_BIN_PATH}/ping_reviewers.py'
     _SCRIPT_SPEC = util.spec_from_file_location('ping_reviewers.py', _SCRIPT_PATH)
     assert _SCRIPT_SPEC
     ping_reviewers = util.module_from_spec(_SCRIPT_SPEC)
@@ -22,7 +26,7 @@ else:
 
 # TODO(cyrille): Add more tests.
 # TODO(cyrille): Use requests_mock.
-@mock.patch(ping_reviewers.requests.__name__ + '.get')
+@mock.patch('requests.Session.get')
 class PingReviewersTestCase(unittest.TestCase):
     """Tests for the ping reviewers feature."""
 
@@ -39,7 +43,7 @@ class PingReviewersTestCase(unittest.TestCase):
             if isinstance(arg, str)
             for word in arg.split(' ')])
 
-    @mock.patch(ping_reviewers.requests.__name__ + '.post')
+    @mock.patch('requests.Session.post')
     def test_directory(self, mock_post: mock.MagicMock, mock_get: mock.MagicMock) -> None:
         """Read all files in a given directory as demos."""
 
@@ -78,6 +82,123 @@ class PingReviewersTestCase(unittest.TestCase):
             'demo.example.com', mock_post.call_args_list[-1].kwargs['json']['text'])
         shutil.rmtree(temp_dir)
 
+    @mock.patch('requests.Session.post')
+    def test_ping_stale_reviews(self, mock_post: mock.MagicMock, mock_get: mock.MagicMock) -> None:
+        """Fetch info for all stale PRs in a single GraphQL query."""
+
+        mock_get().json.return_value = [
+            {
+                'assignees': [{'login': 'reviewer'}],
+                'created_at': '2021-01-01T00:00:00Z',
+                'node_id': f'node-{number}',
+                'number': number,
+                'title': f'Title {number}',
+                'user': {'login': 'my-user'},
+            }
+            for number in range(3)
+        ] + [{
+            'assignees': [{'login': 'reviewer'}],
+            'created_at': '2021-01-01T00:00:00Z',
+            'node_id': 'node-bot',
+            'number': 3,
+            'title': 'Bumping dependencies',
+            'user': {'login': 'dependabot[bot]'},
+        }]
+        mock_get().links = {}
+        mock_post().json.return_value = {'data': {'nodes': [
+            {'commits': {'nodes': [{'commit': {'statusCheckRollup': {'state': 'PENDING'}}}]}},
+            {'commits': {'nodes': [{'commit': {'statusCheckRollup': {'state': 'SUCCESS'}}}]}},
+            None,
+        ]}}
+        mock_post.reset_mock()
+        self.assertEqual(2, ping_reviewers.main(('--ping-stale-reviews',), env={
+            'CIRCLE_PROJECT_USERNAME': 'bayesimpact',
+            'CIRCLE_PROJECT_REPONAME': 'docker-circleci',
+            'GITHUB_TOKEN': 'my-token',
+            'SLACK_INTEGRATION_URL': 'my_url',
+        }))
+        graphql_calls = [
+            call for call in mock_post.call_args_list
+            if call.args[0] == 'https://api.github.com/graphql']
+        self.assertEqual(1, len(graphql_calls), msg=graphql_calls)
+        self.assertEqual(
+            ['node-0', 'node-1', 'node-2'],
+            graphql_calls[0].kwargs['json']['variables']['prNodeIds'])
+
+    @mock.patch('requests.Session.post')
+    def test_ping_stale_reviews_pages(
+            self, mock_post: mock.MagicMock, mock_get: mock.MagicMock) -> None:
+        """Follow the pages of the PR listing, until PRs are too recent."""
+
+        def _make_page(created_at: str, next_url: Optional[str] = None) -> mock.MagicMock:
+            page = mock.MagicMock()
+            page.json.return_value = [{
+                'assignees': [{'login': 'reviewer'}],
+                'created_at': created_at,
+                'node_id': 'node',
+                'number': 1,
+                'title': 'Title',
+                'user': {'login': 'my-user'},
+            }]
+            page.links = {'next': {'url': next_url}} if next_url else {}
+            return page
+
+        mock_get.side_effect = [
+            _make_page('2021-01-01T00:00:00Z', 'https://api.github.com/page2'),
+            _make_page('2021-01-02T00:00:00Z', 'https://api.github.com/page3'),
+            _make_page('2999-01-01T00:00:00Z', 'https://api.github.com/page4'),
+        ]
+        mock_post().json.return_value = {'data': {'nodes': [
+            {'commits': {'nodes': [{'commit': {'statusCheckRollup': {'state': 'PENDING'}}}]}},
+        ] * 2}}
+        self.assertEqual(2, ping_reviewers.main(('--ping-stale-reviews',), env={
+            'CIRCLE_PROJECT_USERNAME': 'bayesimpact',
+            'CIRCLE_PROJECT_REPONAME': 'docker-circleci',
+            'GITHUB_TOKEN': 'my-token',
+            'SLACK_INTEGRATION_URL': 'my_url',
+        }))
+        self.assertEqual([
+            'https://api.github.com/repos/bayesimpact/docker-circleci/pulls'
+            '?direction=asc&per_page=100',
+            'https://api.github.com/page2',
+            'https://api.github.com/page3',
+        ], [call.args[0] for call in mock_get.call_args_list])
+
+    @mock.patch('requests.Session.post')
+    def test_fallback_to_default_channel(
+            self, mock_post: mock.MagicMock, mock_get: mock.MagicMock) -> None:
+        """Ping the default channel once, naming all reviewers, when one cannot be pinged."""
+
+        mock_get().json.return_value = {
+            'assignees': [{'login': 'known'}, {'login': 'unknown'}, {'login': 'other'}],
+            'node_id': 'my-node-id',
+            'number': 42,
+            'title': 'Title',
+            'user': {'login': 'my-user'},
+        }
+        mock_post().json.return_value = \
+            {'data': {'node': {'commits': {'nodes': [{'commit': {'statusCheckRollup': {
+                'contexts': {'nodes': []},
+                'state': 'PENDING',
+            }}}]}}}}
+        mock_post.reset_mock()
+        # The 2 direct pings before the failure for "unknown", and the one on the default channel.
+        self.assertEqual(3, ping_reviewers.main(env={
+            'CIRCLE_PROJECT_USERNAME': 'bayesimpact',
+            'CIRCLE_PROJECT_REPONAME': 'docker-circleci',
+            'CIRCLE_PULL_REQUEST': '/42',
+            'GITHUB_TOKEN': 'my-token',
+            'SLACK_GITHUB_USER_PAIRINGS': '{"known": "U1", "other": "U2"}',
+            'SLACK_INTEGRATION_URL': 'my_url',
+        }))
+        slack_messages = [
+            call.kwargs['json'] for call in mock_post.call_args_list if call.args[0] == 'my_url']
+        self.assertEqual(['@U1', '@U2'], sorted(
+            message['channel'] for message in slack_messages if 'channel' in message))
+        default_messages = [message for message in slack_messages if 'channel' not in message]
+        self.assertEqual(1, len(default_messages), msg=slack_messages)
+        self.assertIn('Reviewers (<@U1>, <@U2>, @unknown) can', default_messages[0]['text'])
+
 
 if __name__ == '__main__':
     unittest.main()